@@ -3,29 +3,34 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import time
 
+'''
+    This function takes in an array of values and returns the indices of
+    the first and last points above the static values at the start
+'''
+def cutIndices(values, baseline=1000, padding=50):
+
+    staticValues = values[0:baseline] # takes the first data points, before anything happens
+    maxVal = (np.max(staticValues)) # gets the maximum of those values
+    booleanData = np.asarray(values) > maxVal # array of booleans that are True if they are > maxVal
+
+    aboveMax = np.flatnonzero(booleanData) # indexes of every True in booleanData
+    if not aboveMax.size:
+        return 0, 0
+
+    indexFirstPoint = aboveMax[0] # index of the first True in booleanData
+    indexLastPoint = aboveMax[-1] + 1 # index just past the last True in booleanData
+
+    return max(indexFirstPoint - padding, 0), indexLastPoint + padding # padding on both sides
+
 '''
     This function takes in a pandas dataset and returns
     the trimmed data with some padding
 '''
-def cutData(dataset):
+def cutData(dataset, baseline=1000, padding=50):
 
+    first, last = cutIndices(dataset['values'].to_numpy(), baseline, padding)
 
-    staticValues = dataset['values'][0:1000] # takes the first ten data points
-    maxVal = (np.max(staticValues)) # gets the maximum of those values
-    booleanData = [dataset['values'] > maxVal] # creates an array of booleans that are True if they are > maxVal
-
-    indexFirstPoint = 0 # index of the first True in booleanData
-    indexLastPoint = 0 # index of the last True in booleanData
-    for i, bool in enumerate(booleanData[0]): # iterates forwards through booleanData until it finds a true value then exits the loop
-        if bool: 
-            indexFirstPoint = i # saves the index of True value
-            break
-    for i, bool in enumerate(reversed(booleanData[0])): # iterates backwards through booleanData until it finds a true value then exits the loop
-        if bool:
-            indexLastPoint = np.size(booleanData) - i # saves the index of True value
-            break
-    
-    cutData = dataset[indexFirstPoint-50:indexLastPoint+50] # creates the trimmed data with 50 points of padding on both sides
+    cutData = dataset[first:last] # creates the trimmed data with padding on both sides
     cutData = cutData.reset_index(drop = True) # resets the indexes after trimming
 
     return cutData
@@ -20,9 +20,13 @@ from constant import *
     
     Running variance algorithm based on the following blog post
     https://www.johndcook.com/blog/standard_deviation/
+
+    The thresholds default to the ones in constant.py, tune.py passes its own
+    and can hand over an already filtered graph so it is not filtered again
 '''
-def findPlateau(graph):
-    graph = filter(graph)
+def findPlateau(graph, filtWidth=FILTWIDTH, timeThreshold=TIMETHRESHOLD, maxVariance=MAXVARIANCE,
+                calcThresh=CALCTHRESH, filtered=None):
+    graph = filter(graph, filtWidth) if filtered is None else filtered
     results = []    # dictionary of plateau values formatted as [value, startTime, endTime, duration]
     varianceGraph = []
     value = startTime = duration = 0
@@ -39,24 +43,24 @@ def findPlateau(graph):
     for x, y in enumerate(graph[:-1], 2):
         # If variance has increased beyond our threshold, record identified plateau using the mean
         # Then, reset running values and counter
-        if(not len(results) or variance > MAXVARIANCE and duration > TIMETHRESHOLD):
+        if(not len(results) or variance > maxVariance and duration > timeThreshold):
             results.append([prevMean, start, x, duration])# Save average as plateau val
             
             # Reset stats
             prevMean = -1
             prevStdDev = 0
             duration = 1
-            start = x + CALCTHRESH
+            start = x + calcThresh
 
         duration += 1 # Increase counter
-        if(duration > CALCTHRESH):
+        if(duration > calcThresh):
 
             if(prevMean < 0 or prevStdDev < 0):
                 prevMean = y 
 
-            mean = prevMean + ((y - prevMean)/(duration-CALCTHRESH))            # Calculate running mean
+            mean = prevMean + ((y - prevMean)/(duration-calcThresh))            # Calculate running mean
             stdDev = prevStdDev + (y - prevMean)*(y - mean)                     # Calculate running standard deviation
-            variance = stdDev/(duration-CALCTHRESH)                             # calculate running variance
+            variance = stdDev/(duration-calcThresh)                             # calculate running variance
         
             prevMean = mean
             prevStdDev = stdDev
@@ -67,8 +71,8 @@ def findPlateau(graph):
     return [results, varianceGraph]
 
 
-def filter(input):
-    return sc.signal.medfilt(input, FILTWIDTH)
+def filter(input, width=FILTWIDTH):
+    return sc.signal.medfilt(input, width)
 
 
 
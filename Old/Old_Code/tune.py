@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from calibrator import findPlateau, filter
+from GetData import cutIndices
+from constant import *
+
+'''
+    Parameter sweep for the plateau finder and data trimming
+
+    FILTWIDTH, TIMETHRESHOLD, MAXVARIANCE and CALCTHRESH in constant.py and
+    the baseline in cutData were tuned by hand for one 1 kHz load cell. This
+    grid (or random) searches them on a process pool over every labeled file
+    in All_Data and writes the best setting for each sensor/rate profile to
+    tuned_constants.json. cutData's padding is a safety margin around the
+    burn rather than something to get right, so it is kept at its default.
+
+    Labels live in labels.json, one entry per file:
+
+        {"file": "2022_2023_Data/Calibration1.csv",   path inside All_Data
+         "column": 0,                                  column holding the sensor
+         "profile": "load_cell_1000Hz",                settings are tuned per profile
+         "rate": 1000,                                 samples per second
+         "plateaus": 6,                                calibration files: plateaus findPlateau should find
+         "burn": [15230, 17890]}                       burn files: first and last sample of the burn
+
+    Files without "plateaus" or "burn" are skipped, so
+        python tune.py --init-labels
+    lists every file for someone to label by hand, then
+        python tune.py --workers 8
+        python tune.py --random 500
+
+    Median filtered signals only depend on the file, the window cutData keeps
+    and FILTWIDTH, so they are cached on disk in .tune_cache and reused by
+    every trial and every run.
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(HERE, "..", "All_Data")
+LABELS_PATH = os.path.join(HERE, "labels.json")
+OUTPUT_PATH = os.path.join(HERE, "tuned_constants.json")
+CACHE_PATH = os.path.join(HERE, ".tune_cache")
+
+# Values tried for every parameter, CALCTHRESH is searched as a fraction of TIMETHRESHOLD like constant.py sets it
+GRID = {"filtWidth": [51, 101, 201, 301, 401, 601],
+        "timeThreshold": [50, 100, 200, 400],
+        "maxVariance": [5, 10, 30, 60, 100],
+        "calcFraction": [0.25, 0.5, 0.75],
+        "baseline": [250, 500, 1000, 2000]}
+
+DEFAULTS = {"filtWidth": FILTWIDTH, "timeThreshold": TIMETHRESHOLD, "maxVariance": MAXVARIANCE,
+            "calcFraction": CALCTHRESH / TIMETHRESHOLD, "baseline": 1000, "padding": 50}
+
+
+'''
+    Reads one column of an archived CSV. The archive has single column files,
+    files padded with empty columns and time,value files, so anything that
+    is not a number is ignored.
+'''
+@lru_cache(maxsize=None)
+def loadColumn(file, column):
+    values = np.genfromtxt(os.path.join(DATA_PATH, file), delimiter=",", usecols=(column,))
+    return values[~np.isnan(values)]
+
+
+def cacheFile(file, column, first, last, width):
+    key = hashlib.sha1(f"{file}:{column}:{first}:{last}".encode()).hexdigest()[:16]
+    return os.path.join(CACHE_PATH, f"{key}_{width}.npy")
+
+
+'''
+    Median filtered samples first to last of a column, from the disk cache if
+    another trial or run already worked it out
+'''
+@lru_cache(maxsize=64)
+def filtered(file, column, first, last, width):
+    path = cacheFile(file, column, first, last, width)
+    if os.path.exists(path):
+        return np.load(path)
+    values = filter(loadColumn(file, column)[first:last], width)
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.npy"
+    np.save(temporary, values)
+    os.replace(temporary, path)  # Another worker may be writing the same file
+    return values
+
+
+'''
+    calibrator.py trims every file with cutData before finding plateaus, so
+    the trimming is tuned first, on the burn files, and the plateau settings
+    are then searched on calibration files trimmed the same way.
+
+    plateauScore is the mean error in plateau count on calibration files and
+    trimScore the mean error in seconds of the detected burn on burn files,
+    lower is better for both. None means the profile has no such files.
+'''
+def plateauScore(params, labels):
+    errors = []
+    calcThresh = params["timeThreshold"] * params["calcFraction"]
+    for label in labels:
+        if "plateaus" not in label:
+            continue
+        column = label.get("column", 0)
+        values = loadColumn(label["file"], column)
+        first, last = cutIndices(values, params["baseline"], params["padding"])
+        values = values[first:last]
+        if len(values) < params["filtWidth"]:
+            continue
+        results, _ = findPlateau(values, params["filtWidth"], params["timeThreshold"], params["maxVariance"],
+                                 calcThresh, filtered(label["file"], column, first, last, params["filtWidth"]))
+        errors.append(abs(len(results) - label["plateaus"]))
+    return float(np.mean(errors)) if errors else None
+
+
+def trimScore(params, labels):
+    # The burn cutIndices detects, without the padding, against the labeled first and last sample of the burn
+    errors = []
+    for label in labels:
+        if "burn" not in label:
+            continue
+        first, end = cutIndices(loadColumn(label["file"], label.get("column", 0)), params["baseline"], 0)
+        start, last = label["burn"]
+        errors.append((abs(first - start) + abs(end - 1 - last)) / label.get("rate", 1000))
+    return float(np.mean(errors)) if errors else None
+
+
+def runTrials(scorer, trials, labels):
+    return [(params, scorer(params, labels)) for params in trials]
+
+
+def makeTrials(names, count, generator):
+    # Every combination of the named parameters, or `count` random ones, plus the current constants
+    if count is None:
+        chosen = [dict(zip(names, values)) for values in itertools.product(*(GRID[name] for name in names))]
+    else:
+        chosen = [{name: generator.choice(GRID[name]) for name in names} for _ in range(count)]
+    chosen.append({name: DEFAULTS[name] for name in names})
+    return chosen
+
+
+'''
+    Scores every trial on the pool and returns (best params, best score,
+    score with the current constants). Trials with the same FILTWIDTH are
+    kept in the same tasks so each worker filters a file once per width.
+    A trial scores None when none of its files can be used (all shorter than
+    its FILTWIDTH), those are left out, and the score with the constants is
+    None if they are. (None, None, None) means no trial could be scored.
+'''
+def search(pool, scorer, trials, labels, workers):
+    groups = {}
+    for params in trials:
+        groups.setdefault(params.get("filtWidth"), []).append(params)
+    size = max(len(trials) // (4 * (workers or os.cpu_count() or 1)), 1)
+    futures = [pool.submit(runTrials, scorer, group[start:start + size], labels)
+               for group in groups.values() for start in range(0, len(group), size)]
+    results = [result for future in futures for result in future.result() if result[1] is not None]
+    if not results:
+        return None, None, None
+    default = next((result for params, result in results if all(params[name] == DEFAULTS[name] for name in params)),
+                   None)
+    best, bestScore = min(results, key=lambda result: result[1])
+    return best, bestScore, default
+
+
+def describe(score, unit=""):
+    return "unusable" if score is None else f"{score:.3f}{unit}"
+
+
+def loadLabels(path):
+    with open(path) as file:
+        labels = json.load(file)
+    usable = [label for label in labels if "plateaus" in label or "burn" in label]
+    profiles = {}
+    for label in usable:
+        profile = label.get("profile", f"column{label.get('column', 0)}_{label.get('rate', 1000)}Hz")
+        profiles.setdefault(profile, []).append(label)
+    return profiles
+
+
+'''
+    Writes a labels.json template with every CSV in All_Data and one entry
+    per column, for the plateau counts and burn windows to be filled in
+'''
+def initLabels(path):
+    labels = []
+    for root, _, files in os.walk(DATA_PATH):
+        for name in sorted(files):
+            if not name.endswith(".csv"):
+                continue
+            file = os.path.relpath(os.path.join(root, name), DATA_PATH)
+            try:
+                data = np.genfromtxt(os.path.join(root, name), delimiter=",", max_rows=10)
+            except ValueError:
+                continue
+            if data.size == 0:
+                continue
+            columns = [i for i in range(data.shape[1] if data.ndim > 1 else 1)
+                       if not np.isnan(data[:, i] if data.ndim > 1 else data).all()]
+            for column in columns:
+                labels.append({"file": file, "column": column, "rate": 1000,
+                               "profile": f"column{column}_1000Hz"})
+    with open(path, "w") as file:
+        json.dump(labels, file, indent=4)
+    print(f"Wrote {len(labels)} entries to {path}, add \"plateaus\" or \"burn\" to the ones to tune on")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the plateau finder and trimming constants")
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="Processes, one per CPU by default")
+    parser.add_argument("--random", type=int, default=None, metavar="TRIALS",
+                        help="Try this many random settings instead of the full grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--init-labels", action="store_true", help="Write a labels template and exit")
+    args = parser.parse_args(argv)
+
+    if args.init_labels:
+        initLabels(args.labels)
+        return 0
+
+    if not os.path.exists(args.labels):
+        print(f"No labels at {args.labels}, run with --init-labels and fill them in first")
+        return 1
+    profiles = loadLabels(args.labels)
+    if not profiles:
+        print(f"None of the entries in {args.labels} have \"plateaus\" or \"burn\" labels yet")
+        return 1
+
+    generator = random.Random(args.seed)
+    plateauTrials = makeTrials(["filtWidth", "timeThreshold", "maxVariance", "calcFraction"], args.random, generator)
+    trimTrials = makeTrials(["baseline"], args.random, generator)
+    defaultCut = {"baseline": DEFAULTS["baseline"], "padding": DEFAULTS["padding"]}
+
+    recommended = {}
+    with ProcessPoolExecutor(args.workers) as pool:
+        for profile, labels in profiles.items():
+            trim, trimBest, trimDefault = search(pool, trimScore, trimTrials, labels, args.workers)
+
+            # Plateaus are found in files trimmed with the best baseline, the constants with cutData's defaults
+            cut = {"baseline": trim["baseline"] if trim is not None else DEFAULTS["baseline"],
+                   "padding": DEFAULTS["padding"]}
+            trials = [dict(params, **cut) for params in plateauTrials]
+            if cut != defaultCut:
+                trials.append({name: DEFAULTS[name] for name in trials[0]})
+            plateau, plateauBest, plateauDefault = search(pool, plateauScore, trials, labels, args.workers)
+
+            settings = {}
+            if plateau is not None:
+                settings.update({"FILTWIDTH": plateau["filtWidth"],
+                                 "TIMETHRESHOLD": plateau["timeThreshold"],
+                                 "MAXVARIANCE": plateau["maxVariance"],
+                                 "CALCTHRESH": plateau["timeThreshold"] * plateau["calcFraction"],
+                                 "plateauScore": plateauBest,
+                                 "plateauScoreWithConstants": plateauDefault})
+            if trim is not None:
+                settings.update({"baseline": trim["baseline"],
+                                 "padding": DEFAULTS["padding"],
+                                 "trimScore": trimBest,
+                                 "trimScoreWithConstants": trimDefault})
+            settings["files"] = [label["file"] for label in labels]
+            recommended[profile] = settings
+
+            print(f"{profile}:")
+            if plateau is not None:
+                print(f"  plateaus  error {plateauBest:.3f} (constant.py {describe(plateauDefault)})  "
+                      f"FILTWIDTH={settings['FILTWIDTH']} TIMETHRESHOLD={settings['TIMETHRESHOLD']} "
+                      f"MAXVARIANCE={settings['MAXVARIANCE']} CALCTHRESH={settings['CALCTHRESH']:g}")
+            if trim is not None:
+                print(f"  trimming  error {trimBest:.3f} s (cutData {describe(trimDefault, ' s')})  "
+                      f"baseline={settings['baseline']} (padding {settings['padding']} kept)")
+
+    with open(args.output, "w") as file:
+        json.dump(recommended, file, indent=4)
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+'''
+    Startup benchmark for the UI
+
+    Measures, each in a fresh interpreter so nothing is already imported:
+        import time        - how long `import ui` takes
+        time to first frame - from the start of `import ui` until the first
+                              state has been drawn by Tk
+        eager imports       - heavy modules loaded before they are needed,
+                              after `import ui` alone when there is no display
+
+    Exits with a non zero status if the median of either is over budget, e.g.
+
+        python bench_startup.py --runs 5 --import-budget 0.5 --frame-budget 1.5
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import ui
+print(time.perf_counter() - start)
+"""
+
+FRAME_SCRIPT = """
+import time
+start = time.perf_counter()
+import ui
+window = ui.UI()
+window.update_idletasks()
+window.update()
+print(time.perf_counter() - start)
+window.destroy()
+"""
+
+HEAVY_MODULES = ["matplotlib.pyplot", "matplotlib", "numpy", "uldaq", "daq", "storage"]
+
+MODULES_SCRIPT = """
+import sys
+import ui
+print(",".join(name for name in {modules!r} if name in sys.modules))
+"""
+
+FRAME_MODULES_SCRIPT = """
+import sys
+import ui
+window = ui.UI()
+window.update()
+print(",".join(name for name in {modules!r} if name in sys.modules))
+window.destroy()
+"""
+
+# Tk errors that only mean there is no display to draw on
+NO_DISPLAY = ("no display name", "couldn't connect to display")
+
+
+def run(script):
+    result = subprocess.run([sys.executable, "-c", script], cwd=HERE, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed")
+    lines = result.stdout.strip().splitlines()
+    return lines[-1] if lines else ""
+
+
+def measure(script, runs):
+    return statistics.median(float(run(script)) for _ in range(runs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the UI startup time budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=0.5, help="Seconds allowed for `import ui`")
+    parser.add_argument("--frame-budget", type=float, default=1.5, help="Seconds allowed until the first frame")
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    import_time = measure(IMPORT_SCRIPT, args.runs)
+    print(f"import ui:           {import_time * 1000:7.1f} ms (budget {args.import_budget * 1000:.0f} ms)")
+    if import_time > args.import_budget:
+        failures.append("import time")
+
+    try:
+        frame_time = measure(FRAME_SCRIPT, args.runs)
+        loaded = run(FRAME_MODULES_SCRIPT.format(modules=HEAVY_MODULES))
+    except RuntimeError as e:
+        if not any(message in str(e) for message in NO_DISPLAY):
+            print(f"time to first frame: failed ({e})")
+            return 1
+        # Tk needs a display, there is nothing to draw the first frame on without one, so only the imports are checked
+        print(f"time to first frame: skipped ({e})")
+        loaded = run(MODULES_SCRIPT.format(modules=HEAVY_MODULES))
+    else:
+        print(f"time to first frame: {frame_time * 1000:7.1f} ms (budget {args.frame_budget * 1000:.0f} ms)")
+        if frame_time > args.frame_budget:
+            failures.append("time to first frame")
+    if loaded:
+        print(f"loaded before they were needed: {loaded}")
+        failures.append("eager imports")
+
+    if failures:
+        print("Over budget: " + ", ".join(failures))
+        return 1
+    print("Within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from derived import standard_channels, THRUST_NAME, IMPULSE_NAME, CHAMBER_PRESSURE_NAME
+import storage
+
+'''
+    Catalog of saved test fires
+
+    One SQLite row per test folder with its metadata, the calibration used and
+    precomputed summary metrics, so questions like "every 98mm test with more
+    than 100 lb of peak thrust" never have to open the recordings, e.g.
+
+        python catalog.py ingest
+        python catalog.py query --type 98mm --min-peak 100
+
+    Rows are only recomputed when the files in a test folder change.
+'''
+
+CATALOG_PATH = os.path.expanduser("~/pydaq/catalog.sqlite")
+
+BURN_THRESHOLD = 0.05  # Fraction of the peak thrust above which the motor counts as burning
+
+COLUMNS = ["path", "name", "test_type", "test_date", "started", "rate", "channels", "samples",
+           "calibration_slope", "calibration_intercept",
+           "peak_thrust", "average_thrust", "impulse", "burn_time", "max_chamber_pressure",
+           "modified", "ingested"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    test_type TEXT,
+    test_date TEXT,
+    started TEXT,
+    rate REAL,
+    channels TEXT,
+    samples INTEGER,
+    calibration_slope REAL,
+    calibration_intercept REAL,
+    peak_thrust REAL,
+    average_thrust REAL,
+    impulse REAL,
+    burn_time REAL,
+    max_chamber_pressure REAL,
+    modified REAL,
+    ingested TEXT
+);
+CREATE INDEX IF NOT EXISTS tests_test_type ON tests (test_type);
+CREATE INDEX IF NOT EXISTS tests_test_date ON tests (test_date);
+CREATE INDEX IF NOT EXISTS tests_peak_thrust ON tests (peak_thrust);
+"""
+
+
+def parse_test_name(name):
+    # Folders are named TestType_Month_Day_Year by the UI, anything else is kept whole as the test type
+    parts = name.split("_")
+    if len(parts) >= 4 and all(part.isdigit() for part in parts[-3:]):
+        month, day, year = (int(part) for part in parts[-3:])
+        try:
+            return "_".join(parts[:-3]), datetime(year, month, day).date().isoformat()
+        except ValueError:
+            pass
+    return name, None
+
+
+def folder_modified(folder):
+    # Only the files directly in the folder, so building a pyramid later does not count as a change
+    files = [os.path.join(folder, file) for file in os.listdir(folder)]
+    return max(os.path.getmtime(file) for file in files if os.path.isfile(file))
+
+
+def summarize(metadata, channels):
+    '''
+        Peak and average thrust, total impulse and burn time of the tared thrust
+        curve, plus the highest chamber pressure
+    '''
+    rate = metadata.get("rate", 1000)
+    summary = {"peak_thrust": None, "average_thrust": None, "impulse": None, "burn_time": None,
+               "max_chamber_pressure": None}
+    derived = standard_channels(metadata, channels)
+
+    if THRUST_NAME in derived and len(derived[THRUST_NAME]):
+        thrust = derived[THRUST_NAME]
+        peak = thrust.max()
+        burning = np.flatnonzero(thrust > BURN_THRESHOLD * peak) if peak > 0 else np.empty(0, int)
+        summary["peak_thrust"] = float(peak)
+        if burning.size:
+            impulse = derived[IMPULSE_NAME]
+            summary["burn_time"] = (burning[-1] + 1 - burning[0]) / rate
+            summary["average_thrust"] = float(thrust[burning[0]:burning[-1] + 1].mean())
+            summary["impulse"] = float(impulse[burning[-1]] - impulse[burning[0]])
+
+    if CHAMBER_PRESSURE_NAME in derived and len(derived[CHAMBER_PRESSURE_NAME]):
+        summary["max_chamber_pressure"] = float(derived[CHAMBER_PRESSURE_NAME].max())
+    return summary
+
+
+class Catalog:
+    def __init__(self, path=CATALOG_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_test(self, folder, force=False):
+        # Returns True if the row was (re)computed, False if it was already up to date
+        folder = os.path.abspath(folder)
+        modified = folder_modified(folder)
+        row = self.connection.execute("SELECT modified FROM tests WHERE path = ?", (folder,)).fetchone()
+        if row is not None and row["modified"] == modified and not force:
+            return False
+
+        metadata, channels = storage.load_test(folder)
+        name = os.path.basename(folder)
+        test_type, test_date = parse_test_name(name)
+        calibration = metadata.get("calibration") or {}
+        samples = metadata.get("samples", max((len(data) for data in channels.values()), default=0))
+
+        entry = {"path": folder,
+                 "name": name,
+                 "test_type": test_type,
+                 "test_date": test_date,
+                 "started": metadata.get("started"),
+                 "rate": metadata.get("rate", 1000),
+                 "channels": ",".join(channels),
+                 "samples": samples,
+                 "calibration_slope": calibration.get("slope"),
+                 "calibration_intercept": calibration.get("intercept"),
+                 "modified": modified,
+                 "ingested": datetime.now().isoformat(timespec="seconds")}
+        entry.update(summarize(metadata, channels))
+
+        with self.connection:
+            self.connection.execute(f"INSERT OR REPLACE INTO tests ({', '.join(COLUMNS)}) "
+                                    f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                                    [entry[column] for column in COLUMNS])
+        return True
+
+    def ingest(self, root=storage.ROOT_PATH, force=False):
+        # Adds every test folder under root and drops rows whose folder is gone, returns (updated, removed)
+        updated = 0
+        if os.path.isdir(root):
+            for name in sorted(os.listdir(root)):
+                folder = os.path.join(root, name)
+                if os.path.isdir(folder) and os.listdir(folder):
+                    try:
+                        updated += self.add_test(folder, force)
+                    except Exception as e:
+                        print(f"\nSkipping {folder}: {e}")
+
+        removed = 0
+        for row in self.connection.execute("SELECT path FROM tests").fetchall():
+            if not os.path.isdir(row["path"]):
+                with self.connection:
+                    self.connection.execute("DELETE FROM tests WHERE path = ?", (row["path"],))
+                removed += 1
+        return updated, removed
+
+    def query(self, test_type=None, min_peak_thrust=None, max_peak_thrust=None, after=None, before=None,
+              order_by="test_date"):
+        # test_type may use SQL wildcards, e.g. "98%"; after and before are ISO dates
+        if order_by not in COLUMNS:
+            raise ValueError(f"Error: Cannot order by {order_by}")
+        conditions = []
+        parameters = []
+        for condition, value in (("test_type LIKE ?", test_type),
+                                 ("peak_thrust >= ?", min_peak_thrust),
+                                 ("peak_thrust <= ?", max_peak_thrust),
+                                 ("test_date >= ?", after),
+                                 ("test_date <= ?", before)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(f"SELECT * FROM tests {where} ORDER BY {order_by}", parameters)
+        return [dict(row) for row in rows]
+
+    def get(self, folder):
+        row = self.connection.execute("SELECT * FROM tests WHERE path = ?", (os.path.abspath(folder),)).fetchone()
+        return dict(row) if row is not None else None
+
+
+def update_catalog(folder, path=CATALOG_PATH):
+    # Called after a test is saved, a broken catalog must never lose a recording
+    try:
+        with Catalog(path) as catalog:
+            catalog.add_test(folder)
+    except Exception as e:
+        print('\n', e)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def print_rows(rows):
+    columns = ["name", "test_date", "samples", "peak_thrust", "average_thrust", "impulse", "burn_time",
+               "max_chamber_pressure"]
+    table = [columns] + [[format_value(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
+    print(f"{len(rows)} tests")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search saved test fires")
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Add new or changed test folders to the catalog")
+    ingest.add_argument("root", nargs="?", default=storage.ROOT_PATH)
+    ingest.add_argument("--force", action="store_true", help="Recompute every test")
+
+    query = commands.add_parser("query", help="List tests matching every given condition")
+    query.add_argument("--type", help="Test type, SQL wildcards allowed (98%%)")
+    query.add_argument("--min-peak", type=float, help="Minimum peak thrust (lb)")
+    query.add_argument("--max-peak", type=float, help="Maximum peak thrust (lb)")
+    query.add_argument("--after", help="Earliest test date, YYYY-MM-DD")
+    query.add_argument("--before", help="Latest test date, YYYY-MM-DD")
+    query.add_argument("--order-by", default="test_date", choices=COLUMNS)
+
+    args = parser.parse_args(argv)
+    with Catalog(args.catalog) as catalog:
+        if args.command == "ingest":
+            updated, removed = catalog.ingest(args.root, args.force)
+            print(f"{updated} tests updated, {removed} removed")
+        else:
+            print_rows(catalog.query(args.type, args.min_peak, args.max_peak, args.after, args.before,
+                                     args.order_by))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import argparse
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+
+from daq import DAQ, DAQGroup, BUFFER_HEADROOM
+from filters import FilterChain, LowPass, Notch, RunningMedian
+import storage
+
+'''
+    Headless test stand runner
+
+    Records straight to disk without Tk or matplotlib so the stand can be run
+    over SSH or from a small single board computer, e.g.
+
+        python cli.py --name 98mm_10_19_2026 --duration 30 --trigger 1:0.05 --pretrigger 2
+'''
+
+
+class Trigger:
+    '''
+        Holds back blocks until `channel` crosses `level`, then releases the
+        last `pretrigger` scans before the crossing followed by everything after it.
+        delay is how many samples the filtered trigger channel lags the raw one.
+    '''
+    def __init__(self, channel, level, pretrigger, delay=0):
+        self.channel = channel
+        self.level = level
+        self.pretrigger = pretrigger
+        self.delay = delay
+        self.triggered = False
+        self.trigger_time = None
+        self.held = []
+
+    def process(self, channels, block, filtered, scales=None):
+        # scales maps a channel to the (scale, offset) of raw counts, the level is always in volts
+        if self.triggered:
+            return block
+
+        delay = self.delay if self.channel in filtered else 0
+        if self.channel in filtered:
+            signal_block = filtered[self.channel]
+        else:
+            signal_block = block[:, channels.index(self.channel)]
+            if scales:
+                scale, offset = scales[self.channel]
+                signal_block = signal_block * scale + offset
+        self.held.append(block)
+        crossings = np.flatnonzero(signal_block >= self.level)
+        if not crossings.size:
+            held = np.concatenate(self.held)
+            keep = self.pretrigger + delay
+            self.held = [held[max(len(held) - keep, 0):]] if keep else []
+            return block[:0]
+
+        self.triggered = True
+        self.trigger_time = time.time()
+        held = np.concatenate(self.held)
+        # A crossing in the filtered stream happened `delay` raw samples earlier
+        crossing = len(held) - len(block) + crossings[0] - delay
+        self.held = []
+        return held[max(crossing - self.pretrigger, 0):]
+
+
+def scan_rate(value):
+    # "max" scans as fast as the device can
+    return None if value.lower() == "max" else float(value)
+
+
+def trigger_spec(value):
+    # CHANNEL:LEVEL, e.g. 1:0.05
+    try:
+        channel, level = value.split(":")
+        return int(channel), float(level)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected CHANNEL:LEVEL, e.g. 1:0.05, not {value!r}")
+
+
+def pressure_scale_spec(value):
+    # VMIN:VMAX:PMAX, e.g. 0.5:4.5:1000
+    try:
+        v_min, v_max, p_max = (float(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected VMIN:VMAX:PMAX, e.g. 0.5:4.5:1000, not {value!r}")
+    if v_max <= v_min:
+        raise argparse.ArgumentTypeError(f"VMAX has to be above VMIN, not {value!r}")
+    return {"v_min": v_min, "v_max": v_max, "p_max": p_max}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Record a test fire without the UI")
+    parser.add_argument("--name", required=True,
+                        help="Test folder name, e.g. TestType_Month_Day_Year")
+    parser.add_argument("--root", default=storage.ROOT_PATH, help="Folder the test folder is created in")
+    parser.add_argument("--channels", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--rate", type=scan_rate, default=1000,
+                        help="Scan rate in Hz, or 'max' for the fastest the device can scan the channels")
+    parser.add_argument("--headroom", type=float, default=BUFFER_HEADROOM,
+                        help="Seconds the circular buffer can hold on top of the longest gap between reads")
+    parser.add_argument("--calibration", default=storage.CALIBRATION_PATH,
+                        help="Load cell calibration saved by the UI, pass 'none' to skip. Without one saved "
+                             "at the default path the load cell is recorded uncalibrated")
+    parser.add_argument("--pressure-scale", type=pressure_scale_spec, default=None, metavar="VMIN:VMAX:PMAX",
+                        help="Pressure transducer output range in volts and the pressure at full scale in psi, "
+                             "recorded with the test for chamber_pressure. Defaults to the one saved with the "
+                             "calibration")
+    parser.add_argument("--save-pressure-scale", action="store_true",
+                        help="Save --pressure-scale with the calibration for later recordings and the UI")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Seconds to record (after the trigger if one is set), runs until Ctrl-C otherwise")
+    parser.add_argument("--trigger", type=trigger_spec, default=None, metavar="CHANNEL:LEVEL",
+                        help="Only start recording once CHANNEL reaches LEVEL volts")
+    parser.add_argument("--pretrigger", type=float, default=1.0, help="Seconds kept from before the trigger")
+    parser.add_argument("--raw", action="store_true",
+                        help="Record 16 bit ADC counts with a per channel scale instead of volts, about 4x smaller")
+    parser.add_argument("--median", type=int, default=None, help="Running median width applied to every channel")
+    parser.add_argument("--lowpass", type=float, default=None, help="Low-pass cutoff in Hz applied to every channel")
+    parser.add_argument("--notch", type=float, default=None, help="Notch frequency in Hz, e.g. 60 for mains hum")
+    parser.add_argument("--all-devices", action="store_true",
+                        help="Scan --channels on every attached board and merge them into one recording, boards that "
+                             "do not share a clock are kept in memory until the end")
+    parser.add_argument("--no-clock-sharing", action="store_true",
+                        help="With --all-devices, align boards by timestamp even if they support an external clock")
+    parser.add_argument("--status-interval", type=float, default=1.0, help="Seconds between health lines")
+    return parser.parse_args(argv)
+
+
+def build_filters(args):
+    filters = {}
+    for channel in args.channels:
+        stages = []
+        if args.notch:
+            stages.append(Notch(args.notch, args.rate))
+        if args.lowpass:
+            stages.append(LowPass(args.lowpass, args.rate))
+        if args.median:
+            stages.append(RunningMedian(args.median))
+        if stages:
+            filters[channel] = FilterChain(*stages)
+    return filters
+
+
+def print_status(daq, writer, trigger, started):
+    elapsed = time.time() - started
+    rate = daq.scans_read / elapsed if elapsed > 0 else 0
+    values = {channel: daq.latest(channel, 1) for channel in daq.channels}
+    latest = "  ".join(f"ch{channel}: {value[-1]:.4f}" for channel, value in values.items() if value.size)
+    state = "armed" if trigger is not None and not trigger.triggered else "recording"
+    print(f"[{elapsed:8.1f} s] {state}  scans: {daq.scans_read}  rate: {rate:.0f} Hz  "
+          f"written: {writer.samples}  queued blocks: {writer.pending}  overruns: {daq.overrun_scans}  {latest}",
+          flush=True)
+
+
+def record_all_devices(args, calibration):
+    group = DAQGroup(clock_sharing=not args.no_clock_sharing)
+    try:
+        group.connect()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    try:
+        if args.rate is None:
+            args.rate = min(daq.plan_scan(args.channels, None, args.headroom).rate for daq in group.daqs)
+        for daq in group.daqs:
+            daq.filters = build_filters(args)
+    except RuntimeError as e:
+        group.disconnect()
+        group.release()
+        raise SystemExit(str(e))
+    except ValueError as e:
+        group.disconnect()
+        group.release()
+        raise SystemExit(f"Error: The filters cannot be used at {args.rate:.0f} Hz: {e}")
+
+    # Boards sharing a clock are written as they come in, timestamp alignment needs the whole run so it is kept
+    # in memory and only written once the scan stops
+    streaming = not args.no_clock_sharing and group.supports_clock_sharing()
+    folder = storage.test_folder([args.name], args.root)
+    channel_map = group.channel_map(args.channels)
+    writer = storage.BackgroundWriter(storage.RecordingWriter(folder, [channel for board, channel in channel_map],
+                                                              args.rate, calibration,
+                                                              boards=[board for board, channel in channel_map],
+                                                              pressure_scale=args.pressure_scale))
+    if not streaming:
+        print("Boards do not share a clock, the run is kept in memory and written when it stops", flush=True)
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    started = time.time()
+    try:
+        group.start_scan(channels=args.channels, rate=args.rate, headroom=args.headroom,
+                         on_block=(lambda channels, block: writer.write(block)) if streaming else None)
+    except RuntimeError as e:
+        group.disconnect()
+        group.release()
+        raise SystemExit(str(e))
+    print(f"Scanning {len(group.daqs)} boards, {group.daqs[0].plan}, Ctrl-C to stop", flush=True)
+    try:
+        while not stopping:
+            time.sleep(args.status_interval)
+            elapsed = time.time() - started
+            print(f"[{elapsed:8.1f} s] " + "  ".join(f"board {i}: {daq.scans_read} scans, {daq.overrun_scans} overruns"
+                                                    for i, daq in enumerate(group.daqs)), flush=True)
+            if args.duration is not None and elapsed >= args.duration:
+                break
+            stopped = [i for i, daq in enumerate(group.daqs) if daq.scan_thread is not None and
+                       not daq.scan_thread.is_alive()]
+            if stopped:
+                print(f"Error: The scan stopped unexpectedly on board {', '.join(map(str, stopped))}", file=sys.stderr)
+                break
+    finally:
+        merged = group.stop_scan()
+        group.disconnect()
+        group.release()
+        if merged is not None:
+            writer.write(merged[2])
+        rate = group.daqs[0].rate or args.rate
+        writer.close(rate=rate,
+                     board_count=len(group.daqs),
+                     clock_shared=group.clock_shared,
+                     overrun_scans=sum(daq.overrun_scans for daq in group.daqs))
+
+    print("\nSummary")
+    print(f"  Folder:        {folder}")
+    print(f"  Boards:        {len(group.daqs)} ({'shared clock' if group.clock_shared else 'timestamp aligned'})")
+    print(f"  Channels:      {', '.join(writer.names)} at {rate:.0f} Hz")
+    print(f"  Scans written: {writer.samples} ({writer.samples / rate:.1f} s)")
+    return 0 if all(daq.overrun_scans == 0 for daq in group.daqs) else 1
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    calibration = None
+    if args.calibration.lower() != "none":
+        if args.calibration == storage.CALIBRATION_PATH and not os.path.exists(args.calibration):
+            print(f"No calibration saved at {args.calibration}, the load cell is recorded uncalibrated")
+        else:
+            try:
+                calibration = storage.load_calibration(args.calibration)
+            except (OSError, ValueError, RuntimeError) as e:
+                raise SystemExit(f"Error: Could not load the calibration from {args.calibration}: {e}")
+            print(f"Calibration: slope {calibration['slope']:.4f}, intercept {calibration['intercept']:.4f}")
+
+    if args.save_pressure_scale:
+        if args.pressure_scale is None or calibration is None:
+            raise SystemExit("Error: --save-pressure-scale needs --pressure-scale and a saved calibration")
+        calibration = storage.save_pressure_scale(args.pressure_scale, args.calibration)
+    if args.pressure_scale is None and calibration is not None:
+        args.pressure_scale = calibration.get("pressure_scale")
+    if args.pressure_scale is None:
+        print("No pressure scale, chamber pressure is not recorded (see --pressure-scale)")
+
+    if args.all_devices:
+        if args.trigger:
+            raise SystemExit("Error: --trigger is not supported with --all-devices")
+        if args.raw:
+            raise SystemExit("Error: --raw is not supported with --all-devices")
+        return record_all_devices(args, calibration)
+
+    if args.trigger:
+        channel, level = args.trigger
+        if channel not in args.channels:
+            raise SystemExit(f"Error: Trigger channel {channel} is not being scanned")
+
+    daq = DAQ()
+    daq.verbose = False
+    daq.keep_data = False
+    daq.connect()
+    if daq.daq_device is None or not daq.daq_device.is_connected():
+        raise SystemExit("Error: Could not connect to a DAQ device")
+
+    # The plan is checked again when the scan starts, this is for the rate the filters and trigger are set up for.
+    # Filters can be impossible at that rate (a notch above Nyquist), so they are built here too
+    try:
+        args.rate = daq.plan_scan(args.channels, args.rate, args.headroom).rate
+        daq.filters = build_filters(args)
+    except RuntimeError as e:
+        daq.disconnect()
+        daq.release()
+        raise SystemExit(str(e))
+    except ValueError as e:
+        daq.disconnect()
+        daq.release()
+        raise SystemExit(f"Error: The filters cannot be used at {args.rate:.0f} Hz: {e}")
+    trigger = None
+    if args.trigger:
+        chain = daq.filters.get(channel)
+        trigger = Trigger(channel, level, int(args.pretrigger * args.rate), chain.delay if chain is not None else 0)
+
+    # Blocks are written on their own thread so formatting CSVs never holds up draining the DAQ
+    folder = storage.test_folder([args.name], args.root)
+    writer = storage.BackgroundWriter(storage.RecordingWriter(folder, args.channels, args.rate, calibration,
+                                                              raw=args.raw, pressure_scale=args.pressure_scale))
+
+    def on_block(channels, block, filtered):
+        if trigger is not None:
+            block = trigger.process(channels, block, filtered, daq.channel_scales)
+        if len(block):
+            writer.write(block)
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    started = time.time()
+    try:
+        daq.start_scan(channels=args.channels, rate=args.rate, on_block=on_block, raw=args.raw,
+                       headroom=args.headroom)
+    except RuntimeError as e:
+        daq.disconnect()
+        daq.release()
+        raise SystemExit(str(e))
+    print(f"Recording to {folder}, {daq.plan}, Ctrl-C to stop", flush=True)
+    try:
+        while not stopping:
+            time.sleep(args.status_interval)
+            print_status(daq, writer, trigger, started)
+            if args.duration is not None:
+                recording_since = started if trigger is None else trigger.trigger_time
+                if recording_since is not None and time.time() - recording_since >= args.duration:
+                    break
+            if daq.scan_thread is not None and not daq.scan_thread.is_alive():
+                print("Error: The scan stopped unexpectedly", file=sys.stderr)
+                break
+    finally:
+        daq.stop_scan()
+        daq.disconnect()
+        daq.release()
+        metadata = writer.close(scales=daq.channel_scales,
+                                rate=daq.rate or args.rate,
+                                overrun_scans=daq.overrun_scans,
+                                trigger="{}:{}".format(*args.trigger) if args.trigger else None,
+                                triggered=trigger.triggered if trigger is not None else None)
+
+    elapsed = time.time() - started
+    print("\nSummary")
+    print(f"  Folder:        {folder}")
+    print(f"  Channels:      {args.channels} at {metadata['rate']:.0f} Hz")
+    print(f"  Run time:      {elapsed:.1f} s")
+    print(f"  Scans read:    {daq.scans_read}")
+    print(f"  Scans written: {writer.samples} ({writer.samples / metadata['rate']:.1f} s)")
+    print(f"  Overruns:      {daq.overrun_scans}")
+    if trigger is not None and not trigger.triggered:
+        print("  The trigger never fired, nothing was recorded")
+    return 0 if daq.overrun_scans == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
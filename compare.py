@@ -0,0 +1,196 @@
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+from scipy import signal
+
+from catalog import Catalog, CATALOG_PATH, summarize, BURN_THRESHOLD
+from derived import standard_channels, THRUST_NAME, CHAMBER_PRESSURE_NAME
+import storage
+
+'''
+    Overlay of several saved tests
+
+    Every test is decimated, aligned to the first one by FFT cross-correlation
+    of its thrust (or chamber pressure) trace and put on a shared time axis that
+    starts at the first test's ignition, so today's burn can be laid over last
+    month's without lining them up by hand, e.g.
+
+        python compare.py ~/pydaq/testFireData/98mm_10_19_2026 ~/pydaq/testFireData/98mm_9_14_2026
+'''
+
+COMPARISON_RATE = 200  # Hz the traces are decimated to before they are aligned
+METRICS = ["peak_thrust", "average_thrust", "impulse", "burn_time", "max_chamber_pressure"]
+
+
+class Comparison:
+    def __init__(self, names, offsets, time, traces, metrics):
+        self.names = names
+        self.offsets = offsets  # Seconds each recording was shifted by to line up with the first one
+        self.time = time  # Seconds from the first test's ignition
+        self.traces = traces  # (tests, samples), NaN where a test has no data
+        with warnings.catch_warnings():
+            # Columns at the very edges can be empty, they are NaN in the mean and spread too
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.mean = np.nanmean(traces, axis=0)
+            self.std = np.nanstd(traces, axis=0)
+        self.metrics = metrics
+
+    def metric_deltas(self):
+        # Each test's metrics minus the first test's
+        reference = self.metrics[0]
+        return [{metric: None if test[metric] is None or reference[metric] is None
+                 else test[metric] - reference[metric] for metric in METRICS} for test in self.metrics]
+
+
+def decimate(data, rate, target_rate=COMPARISON_RATE):
+    # Block means are enough here, the alignment only needs the shape of the burn. Returns (trace, new rate)
+    factor = max(int(rate // target_rate), 1)
+    data = np.asarray(data, dtype=float)
+    usable = len(data) - len(data) % factor
+    return data[:usable].reshape(-1, factor).mean(axis=1), rate / factor
+
+
+def align(reference, trace):
+    '''
+        Returns the shift in samples (fractional) that lines trace up with
+        reference, from the peak of their FFT cross-correlation
+    '''
+    reference = reference - reference.mean()
+    trace = trace - trace.mean()
+    correlation = signal.correlate(reference, trace, mode="full", method="fft")
+    lags = signal.correlation_lags(len(reference), len(trace), mode="full")
+    peak = int(np.argmax(correlation))
+
+    # Parabolic interpolation around the peak for a shift finer than one decimated sample
+    if 0 < peak < len(correlation) - 1:
+        before, at, after = correlation[peak - 1:peak + 2]
+        curvature = before - 2 * at + after
+        if curvature != 0:
+            return lags[peak] + 0.5 * (before - after) / curvature
+    return float(lags[peak])
+
+
+def ignition_index(trace):
+    baseline = np.median(trace[:max(len(trace) // 20, 1)])
+    peak = trace.max() - baseline
+    crossings = np.flatnonzero(trace - baseline > BURN_THRESHOLD * peak) if peak > 0 else []
+    return crossings[0] if len(crossings) else 0
+
+
+def source_names(channel, metadata):
+    # The recorded channels `channel` is derived from, the calibrated CSV is only needed without a calibration
+    if channel == CHAMBER_PRESSURE_NAME:
+        return [storage.CHANNEL_NAMES[0]]
+    if metadata.get("calibration"):
+        return [storage.CHANNEL_NAMES[1]]
+    return [storage.CHANNEL_NAMES[1], storage.CALIBRATED_NAME]
+
+
+def test_metrics(row, metadata, channels):
+    # The catalog already has these for any test it has seen, otherwise they are worked out here
+    if row is None:
+        row = summarize(metadata, channels)
+    return {metric: row[metric] for metric in METRICS}
+
+
+def compare(folders, channel=THRUST_NAME, rate=COMPARISON_RATE, catalog_path=CATALOG_PATH):
+    catalog = Catalog(catalog_path) if os.path.exists(catalog_path) else None
+    names = []
+    traces = []
+    metrics = []
+    trace_rate = None
+    try:
+        for folder in folders:
+            # Tests in the catalog only need the channel being compared, the others are summarized from both
+            row = catalog.get(os.path.abspath(folder)) if catalog is not None else None
+            metadata = storage.load_metadata(folder)
+            sources = source_names(channel, metadata)
+            if row is None:
+                sources += [name for name in source_names(CHAMBER_PRESSURE_NAME if channel == THRUST_NAME
+                                                          else THRUST_NAME, metadata) if name not in sources]
+            metadata, channels = storage.load_test(folder, sources)
+            derived = standard_channels(metadata, channels)
+            if channel not in derived:
+                raise RuntimeError(f"Error: {folder} has no {channel} channel")
+            trace, trace_rate_i = decimate(derived[channel], metadata.get("rate", 1000), rate)
+            if trace_rate is None:
+                trace_rate = trace_rate_i
+            elif not np.isclose(trace_rate, trace_rate_i):
+                # Recordings at rates that are not a multiple of the comparison rate end up on the first one's grid
+                times = np.arange(len(trace)) / trace_rate_i
+                trace = np.interp(np.arange(0, times[-1], 1 / trace_rate), times, trace)
+            names.append(os.path.basename(os.path.normpath(folder)))
+            traces.append(trace)
+            metrics.append(test_metrics(row, metadata, channels))
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    shifts = [0.0] + [align(traces[0], trace) for trace in traces[1:]]
+
+    # Shared grid from the earliest to the latest aligned sample, with zero at the first test's ignition
+    ignition = ignition_index(traces[0])
+    start = min(shift for shift in shifts)
+    stop = max(shift + len(trace) for shift, trace in zip(shifts, traces))
+    grid = np.arange(np.floor(start), np.ceil(stop))
+    aligned = np.full((len(traces), len(grid)), np.nan)
+    for i, (shift, trace) in enumerate(zip(shifts, traces)):
+        aligned[i] = np.interp(grid, shift + np.arange(len(trace)), trace, left=np.nan, right=np.nan)
+
+    return Comparison(names, [shift / trace_rate for shift in shifts], (grid - ignition) / trace_rate, aligned,
+                      metrics)
+
+
+def plot_comparison(ax, comparison, y_label="Thrust (lb)"):
+    for name, trace in zip(comparison.names, comparison.traces):
+        ax.plot(comparison.time, trace, linewidth=0.8, label=name)
+    ax.plot(comparison.time, comparison.mean, color="black", linewidth=1.5, label="Mean")
+    ax.fill_between(comparison.time, comparison.mean - comparison.std, comparison.mean + comparison.std,
+                    color="gray", alpha=0.3, label="±1 std")
+    ax.set_xlabel("Time from ignition (s)")
+    ax.set_ylabel(y_label)
+    ax.legend()
+
+
+def print_comparison(comparison):
+    columns = ["name", "offset"] + METRICS
+    table = [columns]
+    for name, offset, test, delta in zip(comparison.names, comparison.offsets, comparison.metrics,
+                                         comparison.metric_deltas()):
+        row = [name, f"{offset:+.3f} s"]
+        for metric in METRICS:
+            if test[metric] is None:
+                row.append("-")
+            elif name == comparison.names[0] or delta[metric] is None:
+                row.append(f"{test[metric]:.3f}")
+            else:
+                row.append(f"{test[metric]:.3f} ({delta[metric]:+.3f})")
+        table.append(row)
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Overlay saved tests aligned on ignition")
+    parser.add_argument("folders", nargs="+", help="Test folders, the first one is the reference")
+    parser.add_argument("--channel", default=THRUST_NAME, choices=[THRUST_NAME, CHAMBER_PRESSURE_NAME])
+    parser.add_argument("--rate", type=float, default=COMPARISON_RATE, help="Hz to decimate to before aligning")
+    parser.add_argument("--no-plot", action="store_true", help="Only print the offsets and metric deltas")
+    args = parser.parse_args(argv)
+
+    comparison = compare(args.folders, args.channel, args.rate)
+    print_comparison(comparison)
+    if not args.no_plot:
+        from matplotlib import pyplot as plt
+        fig, ax = plt.subplots(figsize=(12, 6))
+        plot_comparison(ax, comparison, "Thrust (lb)" if args.channel == THRUST_NAME else "Chamber pressure (psi)")
+        plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,104 @@
+import re
 import threading
+import time
 
 import numpy as np
 from uldaq import (get_daq_device_inventory, DaqDevice, AInScanFlag,
                    AiInputMode, AiQueueElement, create_float_buffer,
-                   ScanOption, InterfaceType)
+                   ScanOption, ScanStatus, InterfaceType)
 from os import system
 
+from storage import RawChannel, RAW_DTYPE, load_drain_latency, save_drain_latency
+
+BUFFER_HEADROOM = 2.0  # Seconds the reader can fall behind, on top of the longest gap between reads seen so far
+MIN_BUFFER_SCANS = 256
+MAX_BUFFER_BYTES = 512 * 1024 * 1024
+CALIBRATION_DURATION = 2.5  # Seconds averaged for every calibration point
+CALIBRATION_RATE = 1000
+ARM_TIMEOUT = 5.0  # Seconds a board gets to start its scan before a group scan gives up
+MAX_DRAIN_LATENCY = 10.0  # Longer gaps are a suspended computer or a debugger, buffers are not sized for them
+
+
+def range_limits(ai_range):
+    # Range names look like BIP10VOLTS, UNI5VOLTS, BIP1PT25VOLTS or BIPPT625VOLTS
+    match = re.fullmatch(r'(BIP|UNI)(\d*)(?:PT(\d+))?VOLTS', ai_range.name)
+    if match is None:
+        raise RuntimeError(f'Error: Raw counts cannot be scaled for the {ai_range.name} range')
+    span = float(f'{match.group(2) or 0}.{match.group(3) or 0}')
+    return (-span, span) if match.group(1) == 'BIP' else (0.0, span)
+
+
+def count_scale(ai_range, resolution):
+    # volts = counts * scale + offset
+    low, high = range_limits(ai_range)
+    return (high - low) / 2 ** resolution, low
+
+
+class ScanPlan:
+    '''
+        Rate and circular buffer size for a scan, checked against the device.
+        A continuous scan's buffer holds rate * (headroom + drain_latency)
+        scans, so the reader can stall `headroom` seconds longer than the worst
+        gap between reads measured on the device, in this or an earlier run,
+        before scans are overwritten.
+    '''
+    def __init__(self, channels, input_mode, rate, samples_per_channel, max_rate, headroom, drain_latency):
+        self.channels = channels
+        self.input_mode = input_mode
+        self.rate = rate
+        self.samples_per_channel = samples_per_channel
+        self.max_rate = max_rate  # Fastest this many channels can be scanned
+        self.headroom = headroom
+        self.drain_latency = drain_latency
+
+    @property
+    def buffer_seconds(self):
+        return self.samples_per_channel / self.rate
+
+    @property
+    def buffer_bytes(self):
+        return self.samples_per_channel * len(self.channels) * 8
+
+    def __str__(self):
+        return (f'{len(self.channels)} channels at {self.rate:.0f} Hz (max {self.max_rate:.0f} Hz), '
+                f'{self.samples_per_channel} scan buffer ({self.buffer_seconds:.2f} s)')
+
 
 class DAQ:
-    def __init__(self, interface_type=InterfaceType.ANY):
+    def __init__(self, interface_type=InterfaceType.ANY, filters=None):
         self.daq_device = None  
         self.ai_device = None
         self.interface_type = interface_type
         self.scanning = True
+        self.scan_thread = None
+        self.poll_interval = 0.01  # Seconds between reads of the circular buffer
+        self.verbose = True  # Clear the terminal and print the latest value of every channel while scanning
+        self.keep_data = True  # Keep every block in memory, otherwise only the latest block of each channel is kept
         self.pressure_transducer = []
         self.load_cell = []
 
+        # Maps a channel number to a filters.FilterChain that every new block for that channel is run through
+        self.filters = filters if filters is not None else {}
+        self.channel_data = {}
+        self.filtered_data = {}
+
+        # Scan health, readable from other threads while scanning
+        self.channels = []
+        self.rate = None
+        self.scans_read = 0
+        self.overrun_scans = 0
+        self.scan_start_time = None  # time.perf_counter() estimate of when the first scan was taken
+        self.device_id = None  # Unique ID of the connected device, the drain latency is saved under it
+        self.drain_latency = 0.0  # Longest gap between reads of the circular buffer seen on this device
+        self.armed = threading.Event()  # Set once the scan thread has started the scan, or failed to
+        self.plan = None
+
+        # Raw mode keeps unscaled ADC counts as RAW_DTYPE, channel_scales maps a channel to its (scale, offset)
+        self.raw = False
+        self.channel_ranges = []
+        self.resolution = None
+        self.channel_scales = {}
+
     def connect(self, descriptor_index=0):
         try:
             devices = get_daq_device_inventory(self.interface_type)
@@ -23,7 +106,8 @@ class DAQ:
                 raise RuntimeError('Error: No DAQ devices found')
 
             if descriptor_index not in range(len(devices)):
-                raise RuntimeError('Please add devices into CH0 or CH1 only')
+                raise RuntimeError(f'Error: There is no DAQ device at index {descriptor_index}, '
+                                   f'{len(devices)} found')
 
             self.daq_device = DaqDevice(devices[descriptor_index])
             self.ai_device = self.daq_device.get_ai_device()
@@ -41,6 +125,10 @@ class DAQ:
             descriptor = self.daq_device.get_descriptor()
             print('\nConnecting to', descriptor.dev_string, '- please wait...')
             self.daq_device.connect(connection_code=0)
+
+            # Plans start from the worst gap between reads earlier scans on this device had
+            self.device_id = descriptor.unique_id
+            self.drain_latency = max(self.drain_latency, load_drain_latency(self.device_id))
         except Exception as e:
             print('\n', e)
 
@@ -92,6 +180,8 @@ class DAQ:
                     range_index = 0
 
             self.ai_device.a_in_load_queue(queue_list)
+            self.channel_ranges = [queue_element.range for queue_element in queue_list]
+            self.resolution = ai_info.get_resolution()
 
             data = create_float_buffer(channel_count, samples_per_channel)
 
@@ -101,14 +191,60 @@ class DAQ:
         except Exception as e:
             print('\n', e)
 
-    def get_calibration_voltage(self):
+    def plan_scan(self, channels, rate=None, headroom=BUFFER_HEADROOM, duration=None):
+        '''
+            Returns a ScanPlan for `channels` at `rate` Hz, or as fast as the
+            device can scan that many channels when rate is None. With a
+            duration the buffer holds the whole (finite) scan instead. Raises
+            RuntimeError if the device cannot do it, before anything is started.
+        '''
+        if self.ai_device is None or not self.daq_device.is_connected():
+            raise RuntimeError('Error: DAQ device is not connected')
+        ai_info = self.ai_device.get_info()
+        input_mode = AiInputMode.SINGLE_ENDED
+        if ai_info.get_num_chans_by_mode(AiInputMode.SINGLE_ENDED) <= 0:
+            input_mode = AiInputMode.DIFFERENTIAL
+
+        number_of_channels = ai_info.get_num_chans_by_mode(input_mode)
+        missing = [channel for channel in channels if channel >= number_of_channels]
+        if not channels or missing:
+            mode = input_mode.name.lower().replace('_', ' ')
+            raise RuntimeError(f'Error: The device has {number_of_channels} {mode} channels, '
+                               f'it cannot scan {missing or channels}')
+
+        # The per channel limit and the limit on all channels together, whichever is lower
+        max_rate = min(ai_info.get_max_scan_rate(), ai_info.get_max_throughput() / len(channels))
+        rate = max_rate if rate is None else rate
+        if rate > max_rate:
+            raise RuntimeError(f'Error: {len(channels)} channels can be scanned at up to {max_rate:.0f} Hz, '
+                               f'not {rate:.0f} Hz')
+        if rate < ai_info.get_min_scan_rate():
+            raise RuntimeError(f'Error: The slowest the device can scan is {ai_info.get_min_scan_rate():g} Hz')
+
+        drain_latency = max(self.drain_latency, self.poll_interval)
+        if duration is not None:
+            samples_per_channel = int(np.ceil(rate * duration))
+        else:
+            if headroom <= 0:
+                raise RuntimeError('Error: The buffer headroom has to be more than 0 s')
+            samples_per_channel = max(int(np.ceil(rate * (headroom + drain_latency))), MIN_BUFFER_SCANS)
+
+        plan = ScanPlan(list(channels), input_mode, rate, samples_per_channel, max_rate, headroom, drain_latency)
+        if plan.buffer_bytes > MAX_BUFFER_BYTES:
+            raise RuntimeError(f'Error: A {plan.buffer_seconds:.1f} s buffer at {rate:.0f} Hz needs '
+                               f'{plan.buffer_bytes / 2 ** 20:.0f} MB, more than {MAX_BUFFER_BYTES / 2 ** 20:.0f} MB')
+        return plan
+
+    def get_calibration_voltage(self, channel=1, duration=CALIBRATION_DURATION, rate=CALIBRATION_RATE):
+        # Averages `duration` seconds of one channel, rate=None samples as fast as the device can
         try:
             if self.daq_device is None or not self.daq_device.is_connected():
                 print("Error: DAQ device is not connected.")
                 return None
 
-            scan_params = self.setup_scan(channels=[1], samples_per_channel=2500,
-                                          rate=1000, scan_options=ScanOption.DEFAULTIO | ScanOption.CONTINUOUS,
+            plan = self.plan_scan([channel], rate, duration=duration)
+            scan_params = self.setup_scan(channels=plan.channels, samples_per_channel=plan.samples_per_channel,
+                                          rate=plan.rate, scan_options=ScanOption.DEFAULTIO,
                                           flags=AInScanFlag.DEFAULT)
 
             channels, input_mode, range_index, samples_per_channel, \
@@ -118,17 +254,12 @@ class DAQ:
                                             range_index, samples_per_channel,
                                             rate, scan_options, flags, data)
 
-            samples_acquired = 0
-            data_list = []
-            while samples_acquired < samples_per_channel:
-                status, transfer_status = self.ai_device.get_scan_status()
-                index = transfer_status.current_index
-                data_list.append(data[index])
-                samples_acquired += 1
-
-            avg = np.mean(data_list)
-            print(data_list)
-            print(f"\nAverage of {samples_per_channel} samples: {avg}")
+            # Without CONTINUOUS the scan fills the buffer once and stops
+            while self.ai_device.get_scan_status()[0] == ScanStatus.RUNNING:
+                time.sleep(self.poll_interval)
+
+            avg = np.mean(np.ctypeslib.as_array(data))
+            print(f"\nAverage of {samples_per_channel} samples at {rate:.0f} Hz: {avg}")
             return avg
 
         except Exception as e:
@@ -138,48 +269,318 @@ class DAQ:
         finally:
             self.daq_device.release()
 
-    def start_scan(self):
+    def read_new_scans(self, data, channel_count, samples_per_channel, scans_read):
+        """Returns every scan written to the circular buffer since the last read as a (scans, channels) array"""
+        status, transfer_status = self.ai_device.get_scan_status()
+        scan_count = transfer_status.current_scan_count
+        new_scans = scan_count - scans_read
+        if new_scans <= 0:
+            return np.empty((0, channel_count)), scans_read
+        if new_scans > samples_per_channel:
+            self.overrun_scans += new_scans - samples_per_channel
+            print(f'\nWarning: {new_scans - samples_per_channel} scans were overwritten before they were read')
+            scans_read = scan_count - samples_per_channel
+            new_scans = samples_per_channel
+
+        buffer = np.ctypeslib.as_array(data).reshape(samples_per_channel, channel_count)
+        positions = np.arange(scans_read, scan_count) % samples_per_channel
+        return buffer[positions], scan_count
+
+    def store_block(self, channels, block):
+        filtered = {}
+        for i, channel in enumerate(channels):
+            if channel in self.filters:
+                if self.raw:
+                    scale, offset = self.channel_scales[channel]
+                    filtered[channel] = self.filters[channel].process(block[:, i] * scale + offset)
+                else:
+                    filtered[channel] = self.filters[channel].process(block[:, i])
+            if self.keep_data:
+                self.channel_data.setdefault(channel, []).append(block[:, i])
+                if channel in filtered:
+                    self.filtered_data.setdefault(channel, []).append(filtered[channel])
+            else:
+                self.channel_data[channel] = [block[:, i]]
+                if channel in filtered:
+                    self.filtered_data[channel] = [filtered[channel]]
+        return filtered
+
+    def latest(self, channel, count, filtered=True):
+        """Returns up to the last `count` samples of a channel, for live plots and triggers"""
+        source = self.filtered_data if filtered and channel in self.filters else self.channel_data
+        blocks = []
+        total = 0
+        for block in reversed(source.get(channel, [])):
+            blocks.append(block)
+            total += block.size
+            if total >= count:
+                break
+        if not blocks:
+            return np.empty(0)
+        latest = np.concatenate(blocks[::-1])[-count:]
+        if self.raw and source is self.channel_data:
+            scale, offset = self.channel_scales[channel]
+            return latest * scale + offset
+        return latest
+
+    def supports_scan_option(self, option):
+        return bool(self.ai_device.get_info().get_scan_options() & option)
+
+    def start_scan(self, channels=None, rate=1000, on_block=None,
+                   scan_options=ScanOption.DEFAULTIO | ScanOption.CONTINUOUS, raw=False, headroom=BUFFER_HEADROOM):
+        # on_block(channels, block, filtered) is called from the scan thread with every new (scans, channels) block
+        # and a dict of the matching filtered blocks. In raw mode the block holds RAW_DTYPE counts.
+        # rate=None scans as fast as the device can. The plan is checked here, so a scan the device cannot do
+        # raises RuntimeError before anything starts.
+        self.plan = self.plan_scan(channels if channels is not None else [0, 1], rate, headroom)
         self.scanning = True
+        self.raw = raw
+        self.channel_data = {}
+        self.filtered_data = {}
+        self.scans_read = 0
+        self.overrun_scans = 0
+        self.scan_start_time = None
+        self.rate = None
+        self.armed.clear()
+        for chain in self.filters.values():
+            chain.reset()
 
         def scan_thread():
             try:
-                channels = [0, 1]  # Define the channels you want to scan
-                samples_per_channel = 1000  # Define the number of samples per channel
-                rate = 1000  # Define the scan rate in Hz
-                scan_options = ScanOption.DEFAULTIO | ScanOption.CONTINUOUS  # Define the scan options
-                flags = AInScanFlag.DEFAULT  # Define the flags
+                flags = AInScanFlag.NOSCALEDATA if raw else AInScanFlag.DEFAULT  # Define the flags
 
-                channels, input_mode, range_index, samples_per_channel, rate, scan_options, flags, data = (
-                    self.setup_scan(channels, samples_per_channel, rate, scan_options, flags))
+                scan_channels, input_mode, range_index, samples_per_channel, scan_rate, options, flags, data = (
+                    self.setup_scan(self.plan.channels, self.plan.samples_per_channel, self.plan.rate,
+                                    scan_options, flags))
 
-                rate = self.ai_device.a_in_scan(channels[0], channels[-1], input_mode,
-                                                range_index, samples_per_channel,
-                                                rate, scan_options, flags, data)
+                self.channels = scan_channels
+                # Only raw counts need scaling, and not every range has a scale count_scale understands
+                self.channel_scales = {channel: count_scale(ai_range, self.resolution)
+                                       for channel, ai_range in zip(scan_channels, self.channel_ranges)} if raw else {}
+                self.rate = self.ai_device.a_in_scan(scan_channels[0], scan_channels[-1], input_mode,
+                                                     range_index, samples_per_channel,
+                                                     scan_rate, options, flags, data)
+                self.armed.set()
 
-                system('clear')
+                if self.verbose:
+                    system('clear')
 
+                last_read = time.perf_counter()
                 while self.scanning:
                     try:
-                        status, transfer_status = self.ai_device.get_scan_status()
-                        index = transfer_status.current_index
-                        for i in range(len(channels)):
-                            if (index + i) % 2 == 0:
-                                self.pressure_transducer.append(data[index + i])
-                            else:
-                                self.load_cell.append(data[index + i])
-                            print(f'chan {channels[i]}: {data[index + i]}')
+                        block, self.scans_read = self.read_new_scans(data, len(scan_channels), samples_per_channel,
+                                                                     self.scans_read)
+                        # Scans pile up in the buffer for as long as it has been since the last read,
+                        # the longest gap decides how big the next scan's buffer is
+                        now = time.perf_counter()
+                        self.drain_latency = max(self.drain_latency, min(now - last_read, MAX_DRAIN_LATENCY))
+                        last_read = now
+                        if len(block) and raw:
+                            block = np.rint(block).astype(RAW_DTYPE)
+                        if len(block):
+                            # Every read happens some time after the scans were taken, so the earliest
+                            # estimate of the start time is the closest one
+                            start_time = time.perf_counter() - self.scans_read / self.rate
+                            if self.scan_start_time is None or start_time < self.scan_start_time:
+                                self.scan_start_time = start_time
+                            filtered = self.store_block(scan_channels, block)
+                            if on_block is not None:
+                                on_block(scan_channels, block, filtered)
+                            if self.verbose:
+                                for i in range(len(scan_channels)):
+                                    print(f'chan {scan_channels[i]}: {block[-1, i]}')
+                        time.sleep(self.poll_interval)
 
                     except Exception as e:
                         print('\n', e)
 
+                self.ai_device.scan_stop()
+
             except Exception as e:
                 print('\n', e)
+            finally:
+                self.armed.set()
 
-        scan_thread = threading.Thread(target=scan_thread)
-        scan_thread.start()
+        self.scan_thread = threading.Thread(target=scan_thread)
+        self.scan_thread.start()
+
+    def collect(self, channel, filtered=False):
+        # In raw mode the unfiltered data comes back as a storage.RawChannel that converts to volts on access
+        source = self.filtered_data if filtered else self.channel_data
+        blocks = source.get(channel, [])
+        if self.raw and not filtered:
+            scale, offset = self.channel_scales[channel]
+            return RawChannel(np.concatenate(blocks) if blocks else np.empty(0, RAW_DTYPE), scale, offset)
+        return np.concatenate(blocks) if blocks else np.empty(0)
 
     def stop_scan(self):
         self.scanning = False
-        self.pressure_transducer = np.array(self.pressure_transducer)
-        self.load_cell = np.array(self.load_cell)
+        if self.scan_thread is not None:
+            self.scan_thread.join()
+        if self.device_id is not None:
+            try:
+                save_drain_latency(self.device_id, self.drain_latency)
+            except OSError as e:
+                print('\n', e)
+        self.pressure_transducer = self.collect(0)
+        self.load_cell = self.collect(1)
         return self.pressure_transducer, self.load_cell
+
+
+class DAQGroup:
+    '''
+        Scans every attached board at once, one DAQ (and reader thread) per board,
+        and merges them into one recording.
+
+        With clock sharing the first board is the leader and puts its pacer out
+        on its clock output, and the others are scanned off an external clock,
+        which needs that output wired to the clock input of every other board.
+        Then all streams are sample aligned and can be written as they come in.
+        Otherwise every stream is put on the leader's timebase using the start
+        time each DAQ estimates for its scan, which needs every board's whole
+        recording, so it is kept in memory until the scan stops.
+
+        Every merged channel is a (board, channel) pair, board being the DAQ's
+        place in self.daqs, so the first board's channels 0 and 1 are the
+        pressure transducer and load cell whatever is on the other boards.
+    '''
+    def __init__(self, interface_type=InterfaceType.ANY, clock_sharing=True):
+        self.interface_type = interface_type
+        self.clock_sharing = clock_sharing
+        self.clock_shared = False
+        self.daqs = []
+        self.lock = threading.Lock()
+        self.pending = []  # Per board, blocks not yet passed on because another board is behind
+        self.streaming = False
+
+    def connect(self):
+        devices = get_daq_device_inventory(self.interface_type)
+        if not devices:
+            raise RuntimeError('Error: No DAQ devices found')
+
+        # Every board has to connect, skipping one would renumber the boards after it
+        failed = []
+        for descriptor_index in range(len(devices)):
+            daq = DAQ(self.interface_type)
+            daq.verbose = False
+            daq.connect(descriptor_index)
+            if daq.daq_device is not None and daq.daq_device.is_connected():
+                self.daqs.append(daq)
+            else:
+                failed.append(f'{descriptor_index} ({devices[descriptor_index].dev_string})')
+                daq.release()
+        if failed:
+            self.disconnect()
+            self.release()
+            self.daqs = []
+            raise RuntimeError(f'Error: Could not connect to board {", ".join(failed)} of {len(devices)}')
+
+    def disconnect(self):
+        for daq in self.daqs:
+            daq.disconnect()
+
+    def release(self):
+        for daq in self.daqs:
+            daq.release()
+
+    def channel_map(self, channels=None):
+        # (board, channel) of every merged column, in order
+        if channels is not None:
+            return [(board, channel) for board in range(len(self.daqs)) for channel in channels]
+        return [(board, channel) for board, daq in enumerate(self.daqs) for channel in daq.channels]
+
+    def supports_clock_sharing(self):
+        leader, followers = self.daqs[0], self.daqs[1:]
+        return (len(self.daqs) > 1 and leader.supports_scan_option(ScanOption.PACEROUT) and
+                all(daq.supports_scan_option(ScanOption.EXTCLOCK) for daq in followers))
+
+    def start_scan(self, channels=None, rate=1000, headroom=BUFFER_HEADROOM, on_block=None):
+        '''
+            With clock sharing, on_block(channel map, block) is called with
+            sample aligned (scans, every board's channels) blocks as they come
+            in, and the boards keep only their latest block. It cannot be used
+            without clock sharing, then the merged recording comes from stop_scan().
+        '''
+        leader, followers = self.daqs[0], self.daqs[1:]
+        self.clock_shared = self.clock_sharing and self.supports_clock_sharing()
+        if on_block is not None and not self.clock_shared:
+            raise RuntimeError('Error: Blocks can only be streamed from boards sharing a clock')
+
+        # Every board is checked before any of them starts, at full speed that is the slowest board's maximum
+        scan_channels = channels if channels is not None else [0, 1]
+        plans = [daq.plan_scan(scan_channels, rate, headroom) for daq in self.daqs]
+        if rate is None:
+            rate = min(plan.max_rate for plan in plans)
+
+        self.pending = [[] for _ in self.daqs]
+        self.streaming = on_block is not None
+        channel_map = self.channel_map(scan_channels)
+
+        def board_block(board):
+            def store(board_channels, block, filtered):
+                with self.lock:
+                    self.pending[board].append(block)
+                    available = min(sum(len(block) for block in blocks) for blocks in self.pending)
+                    if not available:
+                        return
+                    rows = []
+                    for index, blocks in enumerate(self.pending):
+                        stacked = np.concatenate(blocks)
+                        rows.append(stacked[:available])
+                        self.pending[index] = [stacked[available:]]
+                    on_block(channel_map, np.hstack(rows))
+            return store
+
+        # Followers wait for clock edges, so every one of them has to be scanning before the leader starts
+        for board, daq in enumerate(followers, 1):
+            options = ScanOption.DEFAULTIO | ScanOption.CONTINUOUS
+            if self.clock_shared:
+                options |= ScanOption.EXTCLOCK
+            daq.keep_data = on_block is None
+            daq.start_scan(channels, rate, board_block(board) if on_block is not None else None,
+                           scan_options=options, headroom=headroom)
+            if not daq.armed.wait(ARM_TIMEOUT) or daq.rate is None:
+                for started in followers[:board]:
+                    started.stop_scan()
+                raise RuntimeError(f'Error: Board {board} did not start scanning')
+
+        options = ScanOption.DEFAULTIO | ScanOption.CONTINUOUS
+        if self.clock_shared:
+            options |= ScanOption.PACEROUT
+        leader.keep_data = on_block is None
+        leader.start_scan(channels, rate, board_block(0) if on_block is not None else None,
+                          scan_options=options, headroom=headroom)
+        if not leader.armed.wait(ARM_TIMEOUT) or leader.rate is None:
+            for daq in self.daqs:
+                daq.stop_scan()
+            raise RuntimeError('Error: Board 0 did not start scanning')
+
+    def stop_scan(self):
+        # Returns merged() unless the blocks were streamed to on_block, then they are not kept and it returns None
+        for daq in self.daqs:
+            daq.stop_scan()
+        return None if self.streaming else self.merged()
+
+    def merged(self):
+        """Returns (channel map, seconds since the start, (scans, channels) array) for every board"""
+        streams = []
+        for daq in self.daqs:
+            data = np.column_stack([daq.collect(channel) for channel in daq.channels])
+            streams.append((daq, data))
+        length = min(len(data) for daq, data in streams)
+        leader_rate = streams[0][0].rate
+
+        if self.clock_shared or length == 0:
+            timebase = np.arange(length) / leader_rate
+            columns = [data[:length] for daq, data in streams]
+        else:
+            start = max(daq.scan_start_time for daq, data in streams)
+            end = min(daq.scan_start_time + len(data) / daq.rate for daq, data in streams)
+            timebase = np.arange(0, max(end - start, 0), 1 / leader_rate)
+            columns = []
+            for daq, data in streams:
+                times = daq.scan_start_time - start + np.arange(len(data)) / daq.rate
+                columns.append(np.column_stack([np.interp(timebase, times, data[:, i])
+                                                for i in range(data.shape[1])]))
+
+        return self.channel_map(), timebase, np.hstack(columns)
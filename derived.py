@@ -0,0 +1,186 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import storage
+
+'''
+    Derived channels
+
+    Channels that are calculated from the recorded ones (calibrated load cell,
+    tared thrust, chamber pressure, cumulative impulse) are declared once as
+    expressions over other channels and shared by the plots, export and
+    analysis. Each one is evaluated the first time it is asked for, in fixed
+    size blocks so raw or memory mapped recordings never have to be converted
+    all at once, and cached until something it depends on changes.
+'''
+
+BLOCK_SIZE = 65536
+
+THRUST_NAME = "thrust"
+IMPULSE_NAME = "impulse"
+CHAMBER_PRESSURE_NAME = "chamber_pressure"
+
+TARE_SAMPLES = 1000  # Samples at the start of a recording taken as zero thrust
+
+# Pressure transducer output range and the pressure at full scale from the transducer's datasheet, e.g.
+# {"v_min": 0.5, "v_max": 4.5, "p_max": 1000.0}. Tests are recorded with the one given to cli.py --pressure-scale
+# or saved with the calibration, in the "pressure_scale" entry of their metadata.json. Without either there is no
+# chamber_pressure channel, rather than one in made up psi.
+PRESSURE_SCALE = None
+
+
+class Expression(ABC):
+    def __init__(self, source):
+        self.source = source
+
+    def prepare(self, data):
+        # Returns the state passed to block(), computed from the whole source before the first block
+        return None
+
+    @abstractmethod
+    def block(self, values, state):
+        # Returns the channel's values for one block of its source
+        pass
+
+
+class Linear(Expression):
+    def __init__(self, source, slope, intercept):
+        super().__init__(source)
+        self.slope = slope
+        self.intercept = intercept
+
+    def block(self, values, state):
+        return self.slope * values + self.intercept
+
+
+class Polynomial(Expression):
+    def __init__(self, source, coefficients):
+        # Highest power first, the same order np.polyfit returns
+        super().__init__(source)
+        self.coefficients = list(coefficients)
+
+    def block(self, values, state):
+        return np.polyval(self.coefficients, values)
+
+
+class Tare(Expression):
+    def __init__(self, source, samples=TARE_SAMPLES):
+        super().__init__(source)
+        self.samples = samples
+
+    def prepare(self, data):
+        return float(np.median(np.asarray(data[:self.samples], dtype=float))) if len(data) else 0.0
+
+    def block(self, values, state):
+        return values - state
+
+
+class PressureScale(Expression):
+    def __init__(self, source, v_min, v_max, p_max):
+        super().__init__(source)
+        self.v_min = v_min
+        self.v_max = v_max
+        self.p_max = p_max
+
+    def block(self, values, state):
+        return (values - self.v_min) * (self.p_max / (self.v_max - self.v_min))
+
+
+class CumulativeImpulse(Expression):
+    def __init__(self, source, rate):
+        super().__init__(source)
+        self.rate = rate
+
+    def prepare(self, data):
+        return {"total": 0.0, "previous": None}
+
+    def block(self, values, state):
+        # Trapezoidal rule, carrying the running total and last sample over from the previous block
+        previous = values[0] if state["previous"] is None else state["previous"]
+        increments = (np.concatenate(([previous], values[:-1])) + values) / (2 * self.rate)
+        impulse = state["total"] + np.cumsum(increments)
+        state["total"] = impulse[-1]
+        state["previous"] = values[-1]
+        return impulse
+
+
+class DerivedChannels:
+    def __init__(self, raw=None, block_size=BLOCK_SIZE):
+        self.raw = dict(raw or {})
+        self.expressions = {}
+        self.cache = {}
+        self.block_size = block_size
+
+    def __contains__(self, name):
+        return name in self.raw or name in self.expressions
+
+    def names(self):
+        return list(self.raw) + list(self.expressions)
+
+    def set_raw(self, name, data):
+        self.raw[name] = data
+        self.invalidate(name)
+
+    def define(self, name, expression):
+        self.expressions[name] = expression
+        self.invalidate(name)
+
+    def invalidate(self, name):
+        # Drops the cached values of a channel and of everything calculated from it
+        self.cache.pop(name, None)
+        for other, expression in self.expressions.items():
+            if expression.source == name:
+                self.invalidate(other)
+
+    def set_calibration(self, slope, intercept, name=storage.CALIBRATED_NAME, source=storage.CHANNEL_NAMES[1]):
+        self.define(name, Linear(source, slope, intercept))
+
+    def __getitem__(self, name):
+        if name in self.raw:
+            return self.raw[name]
+        if name not in self.cache:
+            self.cache[name] = self.evaluate(name)
+        return self.cache[name]
+
+    def evaluate(self, name):
+        if name not in self.expressions:
+            raise KeyError(f"Error: There is no channel called {name}")
+        expression = self.expressions[name]
+        source = self[expression.source]
+        state = expression.prepare(source)
+        output = np.empty(len(source))
+        for start in range(0, len(source), self.block_size):
+            values = np.asarray(source[start:start + self.block_size], dtype=float)
+            output[start:start + self.block_size] = expression.block(values, state)
+        return output
+
+
+def standard_channels(metadata, channels):
+    '''
+        The derived channels every test has, built from load_test() style
+        (metadata, {channel name: data}):
+            calibrated_load_cell  load cell through the calibration (lb)
+            thrust                calibrated load cell minus its starting value (lb)
+            impulse               cumulative impulse of the thrust (lb s)
+            chamber_pressure      pressure transducer through the test's pressure_scale
+                                  or PRESSURE_SCALE (psi), only if one of them is set
+    '''
+    rate = metadata.get("rate", 1000)
+    derived = DerivedChannels({name: data for name, data in channels.items() if name != storage.CALIBRATED_NAME})
+
+    calibration = metadata.get("calibration")
+    if calibration:
+        derived.set_calibration(calibration["slope"], calibration["intercept"])
+    elif storage.CALIBRATED_NAME in channels:
+        derived.set_raw(storage.CALIBRATED_NAME, channels[storage.CALIBRATED_NAME])
+
+    if storage.CALIBRATED_NAME in derived:
+        derived.define(THRUST_NAME, Tare(storage.CALIBRATED_NAME))
+        derived.define(IMPULSE_NAME, CumulativeImpulse(THRUST_NAME, rate))
+
+    scale = metadata.get("pressure_scale") or PRESSURE_SCALE
+    if storage.CHANNEL_NAMES[0] in derived and scale:
+        derived.define(CHAMBER_PRESSURE_NAME,
+                       PressureScale(storage.CHANNEL_NAMES[0], scale["v_min"], scale["v_max"], scale["p_max"]))
+    return derived
@@ -0,0 +1,126 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+'''
+    Streaming filter stages
+
+    Every stage keeps whatever state it needs between calls to process(),
+    so feeding a signal through in blocks of any size gives the same output
+    as feeding it through in one go. The cost of a call only depends on the
+    size of the block, never on how much data has come before it.
+
+    The window based stages (RunningMedian, MovingAverage) are causal, so
+    their output lags the input by `delay` samples.
+'''
+
+
+class RunningMedian:
+    def __init__(self, width=301):
+        if width < 1 or width % 2 == 0:
+            raise ValueError('Error: The median filter width must be a positive odd number')
+        self.width = width
+        self.delay = (width - 1) // 2
+        self.history = None
+
+    def reset(self):
+        self.history = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        if block.size == 0:
+            return block
+        if self.history is None:
+            self.history = np.full(self.width - 1, block[0])
+
+        window = np.concatenate((self.history, block))
+        self.history = window[window.size - (self.width - 1):]
+        return np.median(sliding_window_view(window, self.width), axis=1)
+
+
+class MovingAverage:
+    def __init__(self, width=100):
+        if width < 1:
+            raise ValueError('Error: The moving average width must be positive')
+        self.width = width
+        self.delay = (width - 1) // 2
+        self.kernel = np.full(width, 1 / width)
+        self.history = None
+
+    def reset(self):
+        self.history = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        if block.size == 0:
+            return block
+        if self.history is None:
+            self.history = np.full(self.width - 1, block[0])
+
+        window = np.concatenate((self.history, block))
+        self.history = window[window.size - (self.width - 1):]
+        return np.convolve(window, self.kernel, mode='valid')
+
+
+class IIRFilter:
+    def __init__(self, sos):
+        self.sos = np.asarray(sos, dtype=float)
+        self.delay = 0
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        if block.size == 0:
+            return block
+        if self.zi is None:
+            # Start from steady state at the first sample so there is no step transient
+            self.zi = signal.sosfilt_zi(self.sos) * block[0]
+
+        filtered, self.zi = signal.sosfilt(self.sos, block, zi=self.zi)
+        return filtered
+
+
+class LowPass(IIRFilter):
+    def __init__(self, cutoff, rate, order=4):
+        super().__init__(signal.butter(order, cutoff, btype='lowpass', fs=rate, output='sos'))
+
+
+class Notch(IIRFilter):
+    def __init__(self, frequency=60, rate=1000, quality=30):
+        b, a = signal.iirnotch(frequency, quality, fs=rate)
+        super().__init__(signal.tf2sos(b, a))
+
+
+class FilterChain:
+    def __init__(self, *stages):
+        self.stages = list(stages)
+
+    @property
+    def delay(self):
+        return sum(stage.delay for stage in self.stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        for stage in self.stages:
+            block = stage.process(block)
+        return block
+
+
+def filter_offline(data, chain, block_size=65536):
+    '''
+        Runs a whole recording through a filter chain in fixed size blocks
+        so memory stays bounded for long files
+    '''
+    chain.reset()
+    data = np.asarray(data, dtype=float).ravel()
+    output = np.empty_like(data)
+    for start in range(0, data.size, block_size):
+        output[start:start + block_size] = chain.process(data[start:start + block_size])
+    return output
@@ -0,0 +1,241 @@
+import contextlib
+import functools
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+'''
+    Opt-in profiling for the UI
+
+    Off unless SEDS_PROFILE=1 is set or the UI is started with --profile. When
+    on, every state transition, graph, canvas draw, table/graph update and
+    save is timed, the Tk event loop is checked for lag every LAG_INTERVAL
+    seconds and a tracemalloc snapshot is taken whenever the state changes.
+    A report for the session is written to ~/pydaq/profiles when the window
+    closes, e.g.
+
+        SEDS_PROFILE=1 python ui.py
+        python profiling.py                 summary of the latest report
+
+    Only the standard library is used, so it adds nothing to startup when off.
+'''
+
+PROFILE_ENV = "SEDS_PROFILE"
+PROFILE_PATH = os.path.expanduser("~/pydaq/profiles")
+LAG_INTERVAL = 0.05  # Seconds between event loop ticks, lag is how late a tick runs
+TOP_ALLOCATIONS = 10  # Lines with the biggest growth in memory kept per state
+
+
+def enabled_from_environment():
+    return os.environ.get(PROFILE_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {"count": len(ordered),
+            "total": sum(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+            "max": ordered[-1]}
+
+
+class Profiler:
+    '''
+        Collects timings, event loop lag and memory for one session. With
+        enabled=False every method returns straight away, so the UI can call
+        it unconditionally.
+    '''
+    def __init__(self, enabled=False, path=PROFILE_PATH):
+        self.enabled = enabled
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.state = "startup"
+        self.timings = {}  # name -> list of seconds
+        self.events = []  # (seconds since start, state, name, seconds) in the order they finished
+        self.lag = {}  # state -> list of seconds the event loop ticks were late
+        self.states = []  # One entry per state change with its transition time and memory
+        self.snapshot = None
+        self.widget = None
+        self.next_tick = None
+
+    @classmethod
+    def from_environment(cls, enabled=False):
+        return cls(enabled or enabled_from_environment())
+
+    def start(self, widget):
+        # widget is the Tk root, used to schedule the event loop ticks
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.widget = widget
+        self.next_tick = time.perf_counter() + LAG_INTERVAL
+        widget.after(int(LAG_INTERVAL * 1000), self.tick)
+
+    def record(self, name, duration):
+        self.timings.setdefault(name, []).append(duration)
+        self.events.append((time.perf_counter() - duration - self.started, self.state, name, duration))
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def instrument(self, target, attribute, name=None):
+        # Replaces target.attribute with a timed version, for methods of objects the UI does not define
+        if not self.enabled:
+            return
+        method = getattr(target, attribute)
+        name = name or attribute
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.timing(name):
+                return method(*args, **kwargs)
+        setattr(target, attribute, wrapper)
+
+    def tick(self):
+        try:
+            now = time.perf_counter()
+            self.lag.setdefault(self.state, []).append(max(now - self.next_tick, 0.0))
+            self.next_tick = now + LAG_INTERVAL
+            self.widget.after(int(LAG_INTERVAL * 1000), self.tick)
+        except Exception as e:
+            # The window has been destroyed
+            print('\n', e)
+
+    def state_changed(self, state):
+        '''
+            Call at the start of every state change. Takes the memory snapshot
+            for the state being left, then times the transition until Tk has
+            nothing left to do (the new state is built and drawn).
+        '''
+        if not self.enabled:
+            return
+        entry = {"state": state, "from": self.state, "at": time.perf_counter() - self.started}
+        entry.update(self.memory())
+        self.state = state
+        self.states.append(entry)
+        start = time.perf_counter()
+
+        def idle():
+            entry["transition"] = time.perf_counter() - start
+            self.record(f"transition to {state}", entry["transition"])
+        self.widget.after_idle(idle)
+
+    def memory(self):
+        # Memory in use, the peak since the last state change and the lines that grew the most since then
+        current, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")))
+        growth = snapshot.compare_to(self.snapshot, "lineno")[:TOP_ALLOCATIONS] if self.snapshot else []
+        self.snapshot = snapshot
+        return {"memory": current,
+                "peak_memory": peak,
+                "allocations": [{"line": str(stat.traceback[0]), "size_diff": stat.size_diff, "size": stat.size}
+                                for stat in growth]}
+
+    def report(self):
+        end = {"state": "end", "from": self.state, "at": time.perf_counter() - self.started}
+        end.update(self.memory())
+        return {"started": self.started_at.isoformat(timespec="seconds"),
+                "duration": time.perf_counter() - self.started,
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "timings": {name: summarize(durations) for name, durations in self.timings.items()},
+                "event_loop_lag": {state: summarize(lags) for state, lags in self.lag.items() if lags},
+                "states": self.states + [end],
+                "events": [{"at": at, "state": state, "name": name, "duration": duration}
+                           for at, state, name, duration in self.events]}
+
+    def finish(self):
+        # Writes the report for the session and returns its path, or None when profiling is off
+        if not self.enabled:
+            return None
+        report = self.report()
+        tracemalloc.stop()
+        self.enabled = False
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, f"profile_{self.started_at:%Y_%m_%d_%H%M%S}.json")
+        with open(file_path, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Profile written to {file_path}")
+        return file_path
+
+
+def timed(name=None):
+    '''
+        Decorator for methods of objects with a `profiler` attribute, times
+        every call under `name` (the method's name by default)
+    '''
+    def decorator(method):
+        label = name or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, "profiler", None)
+            if profiler is None or not profiler.enabled:
+                return method(self, *args, **kwargs)
+            with profiler.timing(label):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def print_report(report):
+    print(f"Session {report['started']}, {report['duration']:.1f} s, Python {report['python']}")
+
+    print("\nTimings (ms)")
+    print(f"  {'name':40} {'count':>6} {'mean':>9} {'p95':>9} {'max':>9} {'total':>10}")
+    for name, stats in sorted(report["timings"].items(), key=lambda item: -item[1]["total"]):
+        print(f"  {name:40} {stats['count']:6d} {stats['mean'] * 1000:9.1f} {stats['p95'] * 1000:9.1f} "
+              f"{stats['max'] * 1000:9.1f} {stats['total'] * 1000:10.1f}")
+
+    print("\nEvent loop lag (ms)")
+    for state, stats in report["event_loop_lag"].items():
+        print(f"  {state:40} mean {stats['mean'] * 1000:7.1f}  p95 {stats['p95'] * 1000:7.1f}  "
+              f"max {stats['max'] * 1000:7.1f}")
+
+    print("\nTransitions (ms) and memory on leaving each state (MB)")
+    for entry in report["states"]:
+        transition = f"{entry['transition'] * 1000:8.1f}" if "transition" in entry else " " * 8
+        print(f"  {entry['from'] + ' -> ' + entry['state']:60} {transition}  in use {entry['memory'] / 2 ** 20:7.1f}  "
+              f"peak {entry['peak_memory'] / 2 ** 20:7.1f}")
+        for allocation in entry["allocations"][:3]:
+            print(f"      {allocation['size_diff'] / 2 ** 10:+10.1f} KB  {allocation['line']}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        file_path = argv[0]
+    else:
+        reports = sorted(glob.glob(os.path.join(PROFILE_PATH, "profile_*.json")))
+        if not reports:
+            print(f"No profiles in {PROFILE_PATH}, run the UI with {PROFILE_ENV}=1 or --profile first")
+            return 1
+        file_path = reports[-1]
+    with open(file_path) as file:
+        print_report(json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+import storage
+
+'''
+    Min/max pyramid for plotting long recordings
+
+    Level 0 is the recording itself and every level above it keeps the min and
+    max of FACTOR buckets of the level below. To draw a window only the level
+    whose buckets are about one pixel wide is read, so drawing costs the same
+    for a ten second test as for a ten minute one. On disk every level is a
+    flat float32 file that is memory mapped, so only the part in view is read.
+
+    Pyramids are built while recording by storage.RecordingWriter, or the first
+    time a channel is opened, e.g.
+
+        python pyramid.py ~/pydaq/testFireData/98mm_10_19_2026 raw_load_cell
+'''
+
+FACTOR = 16
+LEVEL_DTYPE = np.float32
+BUILD_BLOCK_SIZE = 1 << 20
+
+
+def pyramid_folder(folder, name):
+    return os.path.join(folder, "pyramid", name)
+
+
+class PyramidBuilder:
+    '''
+        Builds a pyramid from blocks of samples as they arrive. With a folder
+        the levels are appended to files there, otherwise they are kept in memory.
+        write_base=False is for channels whose samples are already on disk in a
+        form that can be memory mapped (raw recordings).
+    '''
+    def __init__(self, folder=None, factor=FACTOR, write_base=True):
+        self.folder = folder
+        self.factor = factor
+        self.write_base = write_base
+        self.length = 0
+        self.base = []
+        self.levels = []  # Per level above 0: list of (buckets, 2) arrays, or an open file
+        self.counts = []  # Buckets written per level
+        self.pending = []  # Per level above 0: (mins, maxs) not yet making up a full bucket
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            if write_base:
+                self.base = open(os.path.join(folder, "base.bin"), "wb")
+
+    def add_level(self):
+        level = len(self.levels) + 1
+        if self.folder is not None:
+            self.levels.append(open(os.path.join(self.folder, f"level_{level}.bin"), "wb"))
+        else:
+            self.levels.append([])
+        self.counts.append(0)
+        self.pending.append((np.empty(0, LEVEL_DTYPE), np.empty(0, LEVEL_DTYPE)))
+
+    def store(self, index, mins, maxs):
+        buckets = np.column_stack((mins, maxs)).astype(LEVEL_DTYPE)
+        if self.folder is not None:
+            buckets.tofile(self.levels[index])
+        else:
+            self.levels[index].append(buckets)
+        self.counts[index] += len(buckets)
+
+    def append(self, values):
+        values = np.asarray(values, dtype=LEVEL_DTYPE)
+        if not values.size:
+            return
+        if self.write_base:
+            if self.folder is not None:
+                values.tofile(self.base)
+            else:
+                self.base.append(values)
+        self.length += values.size
+
+        mins = maxs = values
+        index = 0
+        while mins.size:
+            if index == len(self.levels):
+                self.add_level()
+            pending_mins, pending_maxs = self.pending[index]
+            mins = np.concatenate((pending_mins, mins))
+            maxs = np.concatenate((pending_maxs, maxs))
+            complete = mins.size - mins.size % self.factor
+            self.pending[index] = (mins[complete:], maxs[complete:])
+            mins = mins[:complete].reshape(-1, self.factor).min(axis=1)
+            maxs = maxs[:complete].reshape(-1, self.factor).max(axis=1)
+            if mins.size:
+                self.store(index, mins, maxs)
+            index += 1
+
+    def close(self, base=None, base_dtype=None, scale=1.0, offset=0.0):
+        '''
+            Flushes the partial buckets at the end and, for a pyramid on disk,
+            writes info.json. base is the path of the level 0 samples relative to
+            the pyramid folder when write_base is False. Returns the Pyramid.
+        '''
+        index = 0
+        while index < len(self.levels):
+            pending_mins, pending_maxs = self.pending[index]
+            if pending_mins.size:
+                self.store(index, [pending_mins.min()], [pending_maxs.max()])
+                if index + 1 == len(self.levels) and self.counts[index] > 1:
+                    self.add_level()
+                if index + 1 < len(self.levels):
+                    next_mins, next_maxs = self.pending[index + 1]
+                    self.pending[index + 1] = (np.append(next_mins, pending_mins.min()),
+                                               np.append(next_maxs, pending_maxs.max()))
+                self.pending[index] = (np.empty(0, LEVEL_DTYPE), np.empty(0, LEVEL_DTYPE))
+            index += 1
+
+        if self.folder is None:
+            base = np.concatenate(self.base) if self.base else np.empty(0, LEVEL_DTYPE)
+            levels = [np.concatenate(level) for level in self.levels]
+            return Pyramid(base, levels, self.factor, scale, offset)
+
+        if self.write_base:
+            self.base.close()
+        for level in self.levels:
+            level.close()
+        info = {"factor": self.factor,
+                "length": self.length,
+                "levels": len(self.levels),
+                "base": base if not self.write_base else "base.bin",
+                "base_dtype": base_dtype if not self.write_base else np.dtype(LEVEL_DTYPE).name,
+                "scale": scale,
+                "offset": offset}
+        with open(os.path.join(self.folder, "info.json"), "w") as file:
+            json.dump(info, file, indent=4)
+        return load_pyramid(self.folder)
+
+
+class Pyramid:
+    def __init__(self, base, levels, factor=FACTOR, scale=1.0, offset=0.0):
+        # Values are stored in the units of the base (counts for raw recordings), scale and offset give volts
+        self.base = base
+        self.levels = levels
+        self.factor = factor
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def from_array(cls, data, factor=FACTOR):
+        builder = PyramidBuilder(factor=factor)
+        for start in range(0, len(data), BUILD_BLOCK_SIZE):
+            builder.append(data[start:start + BUILD_BLOCK_SIZE])
+        return builder.close()
+
+    def __len__(self):
+        return len(self.base)
+
+    def view(self, start, stop, width):
+        '''
+            Returns (x, mins, maxs) covering samples start to stop in about
+            `width` columns. Where a column is a single sample mins is maxs.
+        '''
+        start = max(int(start), 0)
+        stop = min(int(np.ceil(stop)), len(self))
+        if stop <= start:
+            empty = np.empty(0)
+            return empty, empty, empty
+
+        samples_per_column = (stop - start) / max(width, 1)
+        level = 0
+        while level < len(self.levels) and self.factor ** (level + 1) <= samples_per_column:
+            level += 1
+
+        if level == 0:
+            values = np.asarray(self.base[start:stop], dtype=float) * self.scale + self.offset
+            return np.arange(start, stop), values, values
+
+        size = self.factor ** level
+        first, last = start // size, -(-stop // size)
+        buckets = np.asarray(self.levels[level - 1][first:last], dtype=float)
+
+        # Merge buckets down to about one per column
+        group = max(int(len(buckets) // max(width, 1)), 1)
+        edges = np.arange(0, len(buckets), group)
+        mins = np.minimum.reduceat(buckets[:, 0], edges) * self.scale + self.offset
+        maxs = np.maximum.reduceat(buckets[:, 1], edges) * self.scale + self.offset
+        if self.scale < 0:
+            mins, maxs = maxs, mins
+        return (first + edges) * size, mins, maxs
+
+
+def load_pyramid(path):
+    with open(os.path.join(path, "info.json")) as file:
+        info = json.load(file)
+
+    base_path = os.path.normpath(os.path.join(path, info["base"]))
+    def memmap(file, dtype):
+        if os.path.getsize(file) == 0:
+            return np.empty(0, dtype)
+        return np.memmap(file, dtype=dtype, mode="r")
+
+    base = memmap(base_path, info["base_dtype"])
+    levels = [memmap(os.path.join(path, f"level_{level}.bin"), LEVEL_DTYPE).reshape(-1, 2)
+              for level in range(1, info["levels"] + 1)]
+    return Pyramid(base, levels, info["factor"], info["scale"], info["offset"])
+
+
+def open_pyramid(folder, name):
+    '''
+        Opens the pyramid of one channel of a saved test, building it first if
+        it was not built while recording or the channel has changed since
+    '''
+    path = pyramid_folder(folder, name)
+    metadata = storage.load_metadata(folder)
+    if os.path.exists(os.path.join(path, "info.json")):
+        pyramid = load_pyramid(path)
+        if "samples" not in metadata or len(pyramid) == metadata["samples"]:
+            return pyramid
+
+    channel = storage.load_channel(folder, name, metadata)
+    if isinstance(channel, storage.RawChannel):
+        builder = PyramidBuilder(path, write_base=False)
+        for start in range(0, len(channel), BUILD_BLOCK_SIZE):
+            builder.append(channel.counts[start:start + BUILD_BLOCK_SIZE])
+        return builder.close(os.path.join("..", "..", name + storage.RAW_EXTENSION), metadata["raw"]["dtype"],
+                             channel.scale, channel.offset)
+
+    builder = PyramidBuilder(path)
+    for start in range(0, len(channel), BUILD_BLOCK_SIZE):
+        builder.append(channel[start:start + BUILD_BLOCK_SIZE])
+    return builder.close()
+
+
+class PyramidPlot:
+    '''
+        Draws a pyramid on a matplotlib Axes and redraws just the visible
+        window at screen resolution whenever the x limits change (zoom or pan)
+    '''
+    def __init__(self, ax, pyramid, width=1000, color=None):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.width = width
+        self.line, = ax.plot([], [], color=color, linewidth=0.8)
+        ax.set_xlim(0, max(len(pyramid), 1))
+        self.redraw(ax)
+        x, mins, maxs = pyramid.view(0, len(pyramid), 1)
+        if len(x):
+            margin = (maxs.max() - mins.min()) * 0.05 or 1.0
+            ax.set_ylim(mins.min() - margin, maxs.max() + margin)
+        ax.callbacks.connect("xlim_changed", self.redraw)
+
+    def redraw(self, ax):
+        start, stop = ax.get_xlim()
+        x, mins, maxs = self.pyramid.view(start, stop + 1, self.width)
+        if mins is maxs:
+            self.line.set_data(x, mins)
+        else:
+            # A zig-zag through every column's min and max reads as a filled envelope
+            self.line.set_data(np.repeat(x, 2), np.column_stack((mins, maxs)).ravel())
+        ax.figure.canvas.draw_idle()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("Usage: python pyramid.py TEST_FOLDER CHANNEL_NAME")
+        return 1
+    from matplotlib import pyplot as plt
+    folder, name = argv
+    fig, ax = plt.subplots(figsize=(12, 5))
+    ax.set_title(f"{os.path.basename(os.path.normpath(folder))}: {name}")
+    ax.set_xlabel("Sample")
+    ax.set_ylabel("Voltage")
+    plot = PyramidPlot(ax, open_pyramid(folder, name), width=int(fig.get_figwidth() * fig.dpi))
+    plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy import signal
+
+import storage
+
+'''
+    Spectral analysis for combustion instability screening
+
+    Welch power spectral densities and STFT spectrograms worked out a chunk at
+    a time, carrying the overlap between chunks over so the result is the same
+    as for the whole recording at once. Only one chunk is ever converted to
+    float, so memory mapped or raw recordings at 100 kHz for several minutes
+    stay within a fixed budget, e.g.
+
+        python spectral.py ~/pydaq/testFireData/98mm_10_19_2026 pressure_transducer
+'''
+
+NPERSEG = 4096  # Samples per segment, the frequency resolution is rate / NPERSEG
+CHUNK_SIZE = 1 << 20
+MAX_COLUMNS = 2000  # Spectrogram columns kept, neighbouring segments are averaged down to this
+PEAK_THRESHOLD_DB = 10.0  # How far above the noise floor a peak has to be to be flagged
+MIN_FREQUENCY = 5.0  # Hz, anything below is drift and the burn itself rather than an oscillation
+
+
+def segments(data, nperseg, noverlap, chunk_size=CHUNK_SIZE):
+    '''
+        Yields float arrays holding a whole number of overlapping segments, in
+        order and together covering exactly the segments of the full recording
+    '''
+    step = nperseg - noverlap
+    tail = np.empty(0)
+    for start in range(0, len(data), chunk_size):
+        buffer = np.concatenate((tail, np.asarray(data[start:start + chunk_size], dtype=float)))
+        if len(buffer) < nperseg:
+            tail = buffer
+            continue
+        count = (len(buffer) - nperseg) // step + 1
+        yield buffer[:(count - 1) * step + nperseg], count
+        tail = buffer[count * step:]
+
+
+def segment_settings(length, nperseg):
+    nperseg = min(nperseg, length)
+    return nperseg, nperseg // 2
+
+
+def welch(data, rate, nperseg=NPERSEG, chunk_size=CHUNK_SIZE):
+    # Returns (frequencies, PSD) in units squared per Hz
+    nperseg, noverlap = segment_settings(len(data), nperseg)
+    total = None
+    count = 0
+    for chunk, chunk_count in segments(data, nperseg, noverlap, chunk_size):
+        frequencies, psd = signal.welch(chunk, rate, nperseg=nperseg, noverlap=noverlap)
+        total = psd * chunk_count if total is None else total + psd * chunk_count
+        count += chunk_count
+    if total is None:
+        return np.empty(0), np.empty(0)
+    return frequencies, total / count
+
+
+def spectrogram(data, rate, nperseg=NPERSEG, max_columns=MAX_COLUMNS, chunk_size=CHUNK_SIZE):
+    '''
+        Returns (frequencies, times, power) with power shaped (frequencies,
+        columns). Neighbouring segments are averaged so there are at most
+        max_columns columns whatever the length of the recording.
+    '''
+    nperseg, noverlap = segment_settings(len(data), nperseg)
+    step = nperseg - noverlap
+    total_segments = (len(data) - nperseg) // step + 1 if len(data) >= nperseg else 0
+    group = max(-(-total_segments // max_columns), 1)
+
+    columns = []
+    pending = []
+    frequencies = np.empty(0)
+    for chunk, chunk_count in segments(data, nperseg, noverlap, chunk_size):
+        frequencies, times, power = signal.spectrogram(chunk, rate, nperseg=nperseg, noverlap=noverlap)
+        pending.append(power)
+        pending_power = np.hstack(pending)
+        usable = pending_power.shape[1] - pending_power.shape[1] % group
+        if usable:
+            columns.append(pending_power[:, :usable].reshape(len(frequencies), -1, group).mean(axis=2))
+        pending = [pending_power[:, usable:]]
+    if pending and pending[0].shape[1]:
+        columns.append(pending[0].mean(axis=1, keepdims=True))
+
+    power = np.hstack(columns) if columns else np.empty((len(frequencies), 0))
+    # Every column is centred on the segments it averages, the last one can have fewer than group of them
+    counts = np.full(power.shape[1], group)
+    if len(counts):
+        counts[-1] = total_segments - (len(counts) - 1) * group
+    times = (np.arange(power.shape[1]) * group + (counts - 1) / 2) * step / rate + nperseg / 2 / rate
+    return frequencies, times, power
+
+
+def dominant_frequencies(frequencies, psd, threshold_db=PEAK_THRESHOLD_DB, min_frequency=MIN_FREQUENCY, count=5):
+    '''
+        Returns up to `count` (frequency, dB above the noise floor) for the
+        strongest peaks more than threshold_db above the median of the spectrum
+    '''
+    usable = frequencies >= min_frequency
+    if not usable.any():
+        return []
+    frequencies = frequencies[usable]
+    level = 10 * np.log10(np.maximum(psd[usable], np.finfo(float).tiny))
+    above_floor = level - np.median(level)
+    peaks, _ = signal.find_peaks(above_floor, height=threshold_db)
+    peaks = peaks[np.argsort(above_floor[peaks])[::-1]][:count]
+    return [(float(frequencies[peak]), float(above_floor[peak])) for peak in peaks]
+
+
+def plot_psd(ax, frequencies, psd, peaks=(), label=None):
+    ax.semilogy(frequencies, psd, linewidth=0.8, label=label)
+    for frequency, level in peaks:
+        ax.axvline(frequency, color="red", linewidth=0.6, alpha=0.6)
+        ax.annotate(f"{frequency:.1f} Hz", (frequency, psd[np.searchsorted(frequencies, frequency)]),
+                    fontsize=8, color="red")
+    ax.set_xlabel("Frequency (Hz)")
+    ax.set_ylabel("PSD (V²/Hz)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Welch PSD and spectrogram of a saved test channel")
+    parser.add_argument("folder")
+    parser.add_argument("channel", help="Channel name, e.g. pressure_transducer or raw_load_cell")
+    parser.add_argument("--nperseg", type=int, default=NPERSEG)
+    parser.add_argument("--threshold", type=float, default=PEAK_THRESHOLD_DB, help="dB above the noise floor")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args(argv)
+
+    metadata = storage.load_metadata(args.folder)
+    rate = metadata.get("rate", 1000)
+    data = storage.load_channel(args.folder, args.channel, metadata)
+
+    frequencies, psd = welch(data, rate, args.nperseg)
+    peaks = dominant_frequencies(frequencies, psd, args.threshold)
+    print(f"{os.path.basename(os.path.normpath(args.folder))} {args.channel}: {len(data)} samples at {rate} Hz")
+    if not peaks:
+        print(f"No peaks more than {args.threshold} dB above the noise floor")
+    for frequency, level in peaks:
+        print(f"  {frequency:10.2f} Hz  {level:+.1f} dB")
+
+    if not args.no_plot:
+        from matplotlib import pyplot as plt
+        fig, (psd_ax, spectrogram_ax) = plt.subplots(2, 1, figsize=(12, 8))
+        plot_psd(psd_ax, frequencies, psd, peaks)
+        spectrogram_frequencies, times, power = spectrogram(data, rate, args.nperseg)
+        spectrogram_ax.pcolormesh(times, spectrogram_frequencies, 10 * np.log10(np.maximum(power, 1e-20)),
+                                  shading="auto")
+        spectrogram_ax.set_xlabel("Time (s)")
+        spectrogram_ax.set_ylabel("Frequency (Hz)")
+        plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+import numpy as np
+
+ROOT_PATH = os.path.expanduser("~/pydaq/testFireData")
+CALIBRATION_PATH = os.path.expanduser("~/pydaq/calibration.json")
+DRAIN_LATENCY_PATH = os.path.expanduser("~/pydaq/drain_latency.json")
+
+# CH0 is always the pressure transducer and CH1 the load cell, anything else is named by its channel number
+CHANNEL_NAMES = {0: "pressure_transducer", 1: "raw_load_cell"}
+CALIBRATED_NAME = "calibrated_load_cell"
+LOAD_CELL_CHANNEL = 1
+
+RAW_DTYPE = np.uint16  # Boards are at most 16 bit, so raw counts always fit
+RAW_EXTENSION = ".bin"
+
+
+class RawChannel:
+    '''
+        Raw ADC counts plus the scale and offset that turn them into volts.
+        Counts stay in their 16 bit form (possibly memory mapped from disk) and
+        are only converted for the slice that is asked for.
+    '''
+    def __init__(self, counts, scale, offset):
+        self.counts = counts
+        self.scale = scale
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, key):
+        return self.counts[key] * self.scale + self.offset
+
+    def __array__(self, dtype=None, copy=None):
+        volts = np.asarray(self.counts) * self.scale + self.offset
+        return volts if dtype is None else volts.astype(dtype)
+
+    @property
+    def shape(self):
+        return (len(self.counts),)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes
+
+
+def channel_name(channel, board=0):
+    # Channels of the first (or only) board keep their sensor names, other boards' channels are named by board
+    if board:
+        return f"board_{board}_channel_{channel}"
+    return CHANNEL_NAMES.get(channel, f"channel_{channel}")
+
+
+def test_folder(fields, root_path=ROOT_PATH):
+    return os.path.join(root_path, "_".join(str(field) for field in fields))
+
+
+def save_calibration(slope, intercept, weights=(), voltages=(), path=CALIBRATION_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    calibration = {"slope": float(slope),
+                   "intercept": float(intercept),
+                   "weights": [float(weight) for weight in weights],
+                   "voltages": [float(voltage) for voltage in voltages],
+                   "created": datetime.now().isoformat(timespec="seconds")}
+    # The pressure transducer scale does not change with the load cell, so recalibrating keeps it
+    pressure_scale = load_pressure_scale(path)
+    if pressure_scale is not None:
+        calibration["pressure_scale"] = pressure_scale
+    with open(path, "w") as file:
+        json.dump(calibration, file, indent=4)
+    return calibration
+
+
+def load_calibration(path=CALIBRATION_PATH):
+    with open(path) as file:
+        calibration = json.load(file)
+    if "slope" not in calibration or "intercept" not in calibration:
+        raise RuntimeError(f"Error: {path} is not a load cell calibration")
+    return calibration
+
+
+def save_pressure_scale(pressure_scale, path=CALIBRATION_PATH):
+    # Adds the pressure transducer's {"v_min", "v_max", "p_max"} to a saved calibration for every later recording
+    calibration = load_calibration(path)
+    calibration["pressure_scale"] = pressure_scale
+    with open(path, "w") as file:
+        json.dump(calibration, file, indent=4)
+    return calibration
+
+
+def load_pressure_scale(path=CALIBRATION_PATH):
+    # The pressure scale saved with the calibration, None if there is not one
+    try:
+        with open(path) as file:
+            return json.load(file).get("pressure_scale")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def load_drain_latency(device, path=DRAIN_LATENCY_PATH):
+    # Longest gap between reads of the circular buffer seen on the device in earlier scans, 0 if there were none
+    try:
+        with open(path) as file:
+            return float(json.load(file).get(device, 0.0))
+    except (OSError, ValueError, AttributeError, TypeError):
+        return 0.0
+
+
+def save_drain_latency(device, latency, path=DRAIN_LATENCY_PATH):
+    # Keeps the longest latency of every device, so the next scan's buffer is sized for it from the start
+    try:
+        with open(path) as file:
+            latencies = json.load(file)
+    except (OSError, ValueError):
+        latencies = {}
+    if not isinstance(latencies, dict):
+        latencies = {}
+    if latency <= latencies.get(device, 0.0):
+        return
+    latencies[device] = float(latency)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(latencies, file, indent=4)
+
+
+def write_metadata(folder, metadata):
+    with open(os.path.join(folder, "metadata.json"), "w") as file:
+        json.dump(metadata, file, indent=4)
+
+
+def load_metadata(folder):
+    path = os.path.join(folder, "metadata.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+class RecordingWriter:
+    '''
+        Streams blocks of scans straight to one file per channel so a recording
+        never has to fit in memory. The CSVs match the ones the UI saves, raw
+        recordings store 16 bit counts with the scales in metadata.json.
+        boards gives the board of every channel for recordings from several
+        DAQs, by default they are all on the first board. pressure_scale is
+        saved with the test, chamber pressure is derived from it when read.
+    '''
+    def __init__(self, folder, channels, rate, calibration=None, raw=False, pyramid=True, boards=None,
+                 pressure_scale=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.channels = list(channels)
+        self.boards = list(boards) if boards is not None else [0] * len(self.channels)
+        self.names = [channel_name(channel, board) for channel, board in zip(self.channels, self.boards)]
+        self.load_cell_index = next((i for i, (channel, board) in enumerate(zip(self.channels, self.boards))
+                                     if channel == LOAD_CELL_CHANNEL and board == 0), None)
+        self.rate = rate
+        self.calibration = calibration
+        self.pressure_scale = pressure_scale
+        self.raw = raw
+        self.samples = 0
+        self.started = datetime.now().isoformat(timespec="seconds")
+
+        # Raw recordings are flat binary files of counts, the calibrated load cell is derived from them when read
+        if raw:
+            self.files = [open(os.path.join(folder, name + RAW_EXTENSION), "wb") for name in self.names]
+        else:
+            self.files = [open(os.path.join(folder, name + ".csv"), "w") for name in self.names]
+        self.calibrated_file = None
+        if calibration is not None and self.load_cell_index is not None and not raw:
+            self.calibrated_file = open(os.path.join(folder, CALIBRATED_NAME + ".csv"), "w")
+            # The same calibrated load cell the plots and analysis derive, fed one block at a time
+            from derived import DerivedChannels
+            self.derived = DerivedChannels()
+            self.derived.set_calibration(calibration["slope"], calibration["intercept"])
+
+        # Min/max pyramids for the review plots are built as the data comes in, raw ones over the count files
+        self.pyramids = []
+        if pyramid:
+            from pyramid import PyramidBuilder, pyramid_folder
+            self.pyramids = [PyramidBuilder(pyramid_folder(folder, name), write_base=not raw) for name in self.names]
+
+    def write(self, block, calibrated=None):
+        # calibrated is the already calculated calibrated load cell for this block, if there is one
+        for i, file in enumerate(self.files):
+            if self.raw:
+                np.ascontiguousarray(block[:, i], dtype=RAW_DTYPE).tofile(file)
+            else:
+                np.savetxt(file, block[:, i], delimiter=",")
+        for i, pyramid in enumerate(self.pyramids):
+            pyramid.append(block[:, i])
+        if self.calibrated_file is not None:
+            if calibrated is None:
+                self.derived.set_raw(CHANNEL_NAMES[LOAD_CELL_CHANNEL], block[:, self.load_cell_index])
+                calibrated = self.derived[CALIBRATED_NAME]
+            np.savetxt(self.calibrated_file, calibrated, delimiter=",")
+        self.samples += len(block)
+
+    def close(self, scales=None, **extra):
+        # scales maps a channel to the (scale, offset) of its counts and is required for raw recordings
+        for file in self.files:
+            file.close()
+        if self.calibrated_file is not None:
+            self.calibrated_file.close()
+
+        metadata = {"channels": self.channels,
+                    "rate": self.rate,
+                    "samples": self.samples,
+                    "started": self.started,
+                    "calibration": self.calibration}
+        if self.pressure_scale is not None:
+            metadata["pressure_scale"] = self.pressure_scale
+        if any(self.boards):
+            metadata["boards"] = self.boards
+        if self.raw:
+            metadata["raw"] = {"dtype": np.dtype(RAW_DTYPE).name,
+                               "scales": {name: list(scales[channel])
+                                          for name, channel in zip(self.names, self.channels)}}
+        for name, channel, pyramid in zip(self.names, self.channels, self.pyramids):
+            if self.raw:
+                pyramid.close(os.path.join("..", "..", name + RAW_EXTENSION),
+                              metadata["raw"]["dtype"], *scales[channel])
+            else:
+                pyramid.close()
+        metadata.update(extra)
+        write_metadata(self.folder, metadata)
+
+        from catalog import update_catalog
+        update_catalog(self.folder)
+        return metadata
+
+
+class BackgroundWriter:
+    '''
+        Passes blocks to a RecordingWriter on a thread of its own, so the
+        thread producing them (the DAQ scan thread) never waits on disk or on
+        formatting CSV text. Everything else is read from the RecordingWriter.
+    '''
+    def __init__(self, writer):
+        self.writer = writer
+        self.blocks = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    @property
+    def pending(self):
+        # Blocks waiting to be written
+        return self.blocks.qsize()
+
+    def run(self):
+        while True:
+            item = self.blocks.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    self.writer.write(*item)
+                except Exception as e:
+                    self.error = e
+                    print('\n', e)
+
+    def write(self, block, calibrated=None):
+        self.blocks.put((block, calibrated))
+
+    def close(self, scales=None, **extra):
+        # Waits for every queued block to be written, then closes the RecordingWriter
+        self.blocks.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Error: Writing {self.writer.folder} failed: {self.error}")
+        return self.writer.close(scales, **extra)
+
+
+def save_test(folder, pressure_transducer_data, load_cell_data, slope, intercept, rate=1000, calibrated=None,
+              pressure_scale=None):
+    writer = RecordingWriter(folder, [0, 1], rate, {"slope": float(slope), "intercept": float(intercept)},
+                             pressure_scale=pressure_scale)
+    writer.write(np.column_stack((np.ravel(pressure_transducer_data), np.ravel(load_cell_data))),
+                 None if calibrated is None else np.ravel(calibrated))
+    return writer.close()
+
+
+def load_channel(folder, name, metadata=None):
+    '''
+        Loads one channel of a saved test by name. Raw channels come back as a
+        memory mapped RawChannel. CSV channels with a complete pyramid come back
+        as its memory mapped float32 base, the same samples without parsing the
+        CSV, others as a float array read from the CSV.
+    '''
+    metadata = load_metadata(folder) if metadata is None else metadata
+    raw_path = os.path.join(folder, name + RAW_EXTENSION)
+    if "raw" in metadata and os.path.exists(raw_path):
+        scale, offset = metadata["raw"]["scales"][name]
+        if os.path.getsize(raw_path) == 0:
+            counts = np.empty(0, dtype=metadata["raw"]["dtype"])
+        else:
+            counts = np.memmap(raw_path, dtype=metadata["raw"]["dtype"], mode="r")
+        return RawChannel(counts, scale, offset)
+
+    from pyramid import load_pyramid, pyramid_folder
+    path = pyramid_folder(folder, name)
+    if "samples" in metadata and os.path.exists(os.path.join(path, "info.json")):
+        pyramid = load_pyramid(path)
+        if len(pyramid) == metadata["samples"] and (pyramid.scale, pyramid.offset) == (1.0, 0.0):
+            return pyramid.base
+    return np.loadtxt(os.path.join(folder, name + ".csv"), delimiter=",", ndmin=1)
+
+
+def load_test(folder, names=None):
+    '''
+        Returns (metadata, {channel name: data}) for a saved test. Folders
+        saved before metadata.json existed are read from their CSVs. names
+        limits it to those channels, the others are never read.
+    '''
+    wanted = names
+    metadata = load_metadata(folder)
+    if "channels" in metadata:
+        boards = metadata.get("boards", [0] * len(metadata["channels"]))
+        names = [channel_name(channel, board) for channel, board in zip(metadata["channels"], boards)]
+    else:
+        names = [name for name in (CHANNEL_NAMES[0], CHANNEL_NAMES[1])
+                 if os.path.exists(os.path.join(folder, name + ".csv"))]
+    if wanted is not None:
+        names = [name for name in names if name in wanted]
+    channels = {name: load_channel(folder, name, metadata) for name in names}
+    if (wanted is None or CALIBRATED_NAME in wanted) and os.path.exists(os.path.join(folder, CALIBRATED_NAME + ".csv")):
+        channels[CALIBRATED_NAME] = load_channel(folder, CALIBRATED_NAME, metadata)
+    return metadata, channels
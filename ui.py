@@ -2,13 +2,23 @@ from tkinter import *
 from tkinter.ttk import *
 from typing import Tuple, Union
 import customtkinter as ctk
-import numpy as np
 import re
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import sys
 from enum import Enum
-from daq import DAQ
-import os
+
+import profiling
+
+# numpy, matplotlib, daq (uldaq) and storage are imported where they are first used so the window comes up
+# without waiting on them, see bench_startup.py for the startup budget
+
+
+def make_figure(master):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    fig = Figure(figsize=(6, 5))
+    ax = fig.add_subplot()
+    canvas = FigureCanvasTkAgg(fig, master=master)
+    return fig, ax, canvas
 
 class ui_states(Enum):
     CALIBRATION = 1
@@ -25,25 +35,70 @@ class test_fire_ui_states(Enum):
     PRESSURE_TRANSDUCER = 4
     CALIBRATED_LOAD_CELL = 5
     SAVE_DATA = 6
+    SPECTRUM = 7
 
 ctk.set_default_color_theme("dark-blue")  
 ctk.set_appearance_mode("dark")
 
 class UI(ctk.CTk):
-    def __init__(self, fg_color: Union[str, Tuple[str, str], None] = None, **kwargs): 
+    def __init__(self, fg_color: Union[str, Tuple[str, str], None] = None, profile=False, **kwargs): 
         super().__init__(fg_color, **kwargs) 
 
+        # Does nothing unless profile is set or SEDS_PROFILE=1, see profiling.py
+        self.profiler = profiling.Profiler.from_environment(profile)
+        self.profiler.start(self)
+
         self.ui_state = ui_states.CALIBRATION  # Initial state of UI
         self.calibration_state = calibration_states.REMINDER
         self.test_fire_state = None
 
         self.pressure_transducer_data = None
         self.load_cell_data = None
+        self.derived = None  # derived.DerivedChannels of the last test fire, shared by the graphs and saving
         self.test_fire_daq = None
 
         self.title("UB SEDS Test Fire Interface")
         self.geometry("1000x600")
 
+        self.timer = 0
+        self.slope = None
+        self.intercept = None
+
+        self.weights = []
+        self.voltages = []
+
+        self.data_save_entries = []
+
+        # Widgets for each state are only built the first time that state is shown
+        self.widget_builders = {
+            calibration_states.REMINDER: self.build_reminder_widgets,
+            calibration_states.INTERFACE: self.build_calibration_widgets,
+            test_fire_ui_states.START: self.build_start_widgets,
+            test_fire_ui_states.DATA_ACQUISITION: self.build_data_acquisition_widgets,
+            test_fire_ui_states.SAVE_DATA: self.build_save_data_widgets,
+        }
+        self.built_states = set()
+
+        self.set_UI_visibility_based_on_state()
+
+    def build_widgets_for_state(self, state):
+        if state in self.widget_builders and state not in self.built_states:
+            self.widget_builders[state]()
+            self.built_states.add(state)
+
+    def build_reminder_widgets(self):
+        self.big_flashing_reminder_button = ctk.CTkButton(self, text="HI SCHOONER!!!\n"
+                                                                     "PLEASE MAKE SURE\n"
+                                                                     "TO PUT THE PRESSURE TRANSDUCER INTO CH0\n"
+                                                                     "AND\n"
+                                                                     "PUT THE LOAD CELL INTO CH1\n"
+                                                                     "PLEASE CLICK THIS BUTTON\n"
+                                                                     "IF AND ONLY IF YOU HAVE CORRECTLY\n"
+                                                                     "SET UP THE DAQ!!! - PARTH",
+                                                          command=self.schooner_has_been_reminded)
+        self.big_flashing_reminder_button.configure(font=('Arial', 40), fg_color='red')
+
+    def build_calibration_widgets(self):
         self.data_table = Treeview(self, columns=('Weight', 'Voltage'), show="headings")
         self.data_table.heading('Weight', text='Weight (lb)')
         self.data_table.heading('Voltage', text='Voltage (mV)')
@@ -54,10 +109,10 @@ class UI(ctk.CTk):
         self.y_scroll = Scrollbar(self, orient=VERTICAL, command=self.data_table.yview)
         self.data_table.configure(yscrollcommand=self.y_scroll.set)
 
-        self.fig, self.ax = plt.subplots(figsize=(6, 5))
+        self.fig, self.ax, self.canvas = make_figure(self)
+        self.profiler.instrument(self.canvas, "draw", "canvas.draw")
         self.ax.set_ylabel("Weight (lbs)")
         self.ax.set_xlabel("Voltage (mV)")
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
 
         self.data_entry_submit_button = ctk.CTkButton(self, text="✔", command=self.get_input_calibration_datapoints)
         self.data_entry_submit_button.configure(height=25, width=20)
@@ -73,37 +128,18 @@ class UI(ctk.CTk):
         self.finish_calibration_button = ctk.CTkButton(self, text="FINISH CALIBRATION", command=self.finish_calibration)
         self.finish_calibration_button.configure(height=20)
 
-        self.big_flashing_reminder_button = ctk.CTkButton(self, text="HI SCHOONER!!!\n"
-                                                                     "PLEASE MAKE SURE\n"
-                                                                     "TO PUT THE PRESSURE TRANSDUCER INTO CH0\n"
-                                                                     "AND\n"
-                                                                     "PUT THE LOAD CELL INTO CH1\n"
-                                                                     "PLEASE CLICK THIS BUTTON\n"
-                                                                     "IF AND ONLY IF YOU HAVE CORRECTLY\n"
-                                                                     "SET UP THE DAQ!!! - PARTH",
-                                                          command=self.schooner_has_been_reminded)
-        self.big_flashing_reminder_button.configure(font=('Arial', 40), fg_color='red')
-
+    def build_start_widgets(self):
         self.begin_test_fire = ctk.CTkButton(self, text="Start Test Fire", command=self.start_test_fire_button)
+        self.linear_regression_parameters = Label(self)
+        self.start_error_label = Label(self, foreground="red", justify="center")
 
-        self.timer = 0
+    def build_data_acquisition_widgets(self):
         self.timer_label = Label(self, text=f"{self.timer} ms", font=("arial", 24))
-
         self.terminate_button = ctk.CTkButton(self, text="TERMINATE TEST FIRE", command=self.terminate_test_fire_button)
 
-        self.slope = None
-        self.intercept = None
-
-        self.linear_regression_parameters = Label(self)
-
-        self.weights = []
-        self.voltages = []
-
-        self.data_save_entries = []
+    def build_save_data_widgets(self):
         self.save_data_button = ctk.CTkButton(self, text="Save Data", command=self.save_data_as_csv)
 
-        self.set_UI_visibility_based_on_state()
-
     def change_state(self, new_test_fire_state):
         self.test_fire_state = new_test_fire_state
         self.set_UI_visibility_based_on_state()
@@ -115,13 +151,43 @@ class UI(ctk.CTk):
     def test_fire_label_factory(self, text):
         return Label(self, text=text, justify="center")
 
+    @profiling.timed()
     def graph_factory(self, x_label, y_label, data):
-        fig, ax = plt.subplots(figsize=(6, 5))
+        # Review graphs draw a min/max pyramid of the data, so zooming and panning (with the toolbar) only ever
+        # redraws the visible window at screen resolution
+        import numpy as np
+        from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+        from pyramid import Pyramid, PyramidPlot
+        fig, ax, canvas = make_figure(self)
+        self.profiler.instrument(canvas, "draw", "canvas.draw")
         ax.set_ylabel(y_label)
         ax.set_xlabel(x_label)
-        canvas = FigureCanvasTkAgg(fig, master=self)
+        toolbar = NavigationToolbar2Tk(canvas, self, pack_toolbar=False)
+        toolbar.pack(side=BOTTOM)
         canvas.get_tk_widget().pack(expand=True)
-        ax.plot(range(len(data)), data)
+        # matplotlib only keeps weak references to callbacks, so the plot has to be held on to
+        self.review_plot = PyramidPlot(ax, Pyramid.from_array(np.ravel(data)), width=int(fig.get_figwidth() * fig.dpi))
+        return fig, ax, canvas
+
+    @profiling.timed()
+    def spectrum_factory(self):
+        # Welch PSDs of both sensors with the dominant frequencies marked, to screen for combustion instability
+        import storage
+        import spectral
+        fig, ax, canvas = make_figure(self)
+        self.profiler.instrument(canvas, "draw", "canvas.draw")
+        rate = self.test_fire_daq.rate or 1000
+        found = []
+        for name, label in ((storage.CHANNEL_NAMES[0], "Pressure Transducer"), (storage.CHANNEL_NAMES[1], "Load Cell")):
+            frequencies, psd = spectral.welch(self.derived[name], rate)
+            if not len(frequencies):
+                continue
+            peaks = spectral.dominant_frequencies(frequencies, psd)
+            spectral.plot_psd(ax, frequencies, psd, peaks, label=label)
+            found.append(f"{label}: " + (", ".join(f"{frequency:.1f} Hz" for frequency, level in peaks) or "none"))
+        ax.legend()
+        canvas.get_tk_widget().pack(expand=True)
+        self.test_fire_label_factory("Dominant frequencies\n" + "\n".join(found)).place(x=10, y=60)
         return fig, ax, canvas
 
     def clear_screen(self):
@@ -130,9 +196,14 @@ class UI(ctk.CTk):
                 child.pack_forget()
                 child.place_forget()
 
+    @profiling.timed()
     def set_UI_visibility_based_on_state(self):
-        print(self.ui_state, self.calibration_state, self.test_fire_state)
+        self.profiler.state_changed(self.ui_state.name + "." + (self.calibration_state.name
+                                                                if self.ui_state == ui_states.CALIBRATION
+                                                                else self.test_fire_state.name))
         self.clear_screen()
+        self.build_widgets_for_state(self.calibration_state if self.ui_state == ui_states.CALIBRATION
+                                     else self.test_fire_state)
         if self.ui_state == ui_states.CALIBRATION:
             if self.calibration_state == calibration_states.REMINDER:
                 self.big_flashing_reminder_button.pack(expand=True)
@@ -170,11 +241,18 @@ class UI(ctk.CTk):
                                                                  test_fire_ui_states.PRESSURE_TRANSDUCER).place(x=10,
                                                                                                                 y=10)
             elif self.test_fire_state == test_fire_ui_states.CALIBRATED_LOAD_CELL:
-                data = self.slope * self.load_cell_data + self.intercept
-                self.graph_factory("Weight", "Time", data)
+                import storage
+                self.graph_factory("Weight", "Time", self.derived[storage.CALIBRATED_NAME])
                 self.test_fire_label_factory("Calibrated Load Cell Data").place(x=425, y=10)
                 self.create_state_change_button_for_test_fire_ui("Previous",
                                                                  test_fire_ui_states.RAW_LOAD_CELL).place(x=10, y=10)
+                self.create_state_change_button_for_test_fire_ui("Next", test_fire_ui_states.SPECTRUM).place(x=850, y=10)
+            elif self.test_fire_state == test_fire_ui_states.SPECTRUM:
+                self.spectrum_factory()
+                self.test_fire_label_factory("Spectrum").place(x=460, y=10)
+                self.create_state_change_button_for_test_fire_ui("Previous",
+                                                                 test_fire_ui_states.CALIBRATED_LOAD_CELL).place(x=10,
+                                                                                                                 y=10)
                 self.create_state_change_button_for_test_fire_ui("Next", test_fire_ui_states.SAVE_DATA).place(x=850, y=10)
             elif self.test_fire_state == test_fire_ui_states.SAVE_DATA:
                 self.save_data_button.pack(expand=True)
@@ -185,8 +263,10 @@ class UI(ctk.CTk):
                     entry.place(x=200+(i*150), y=200)
                     self.data_save_entries.append(entry)
 
+    @profiling.timed()
     def get_input_calibration_datapoints(self):
         if self.ui_state == ui_states.CALIBRATION:
+            from daq import DAQ
             load_cell_daq = DAQ()
             load_cell_daq.connect()
             expression = self.data_entry_field.get()  
@@ -220,6 +300,7 @@ class UI(ctk.CTk):
                 self.update_table()
                 self.update_graph()
 
+    @profiling.timed()
     def update_table(self):
         if self.ui_state == ui_states.CALIBRATION and self.calibration_state == calibration_states.INTERFACE:
             self.data_table.delete(*self.data_table.get_children())  # Clear the table
@@ -234,8 +315,10 @@ class UI(ctk.CTk):
                 self.data_table['height'] = len(self.weights)
                 self.y_scroll.place_forget()
 
+    @profiling.timed()
     def update_graph(self):
         if self.ui_state == ui_states.CALIBRATION and self.calibration_state == calibration_states.INTERFACE:
+            import numpy as np
             self.ax.clear()
             self.ax.scatter(self.voltages, self.weights, color='blue')
             self.ax.set_xlabel("Voltage (mV)")
@@ -256,6 +339,9 @@ class UI(ctk.CTk):
         if (len(self.weights) >= 5 and
                 self.ui_state == ui_states.CALIBRATION and
                 self.calibration_state == calibration_states.INTERFACE):
+            import storage
+            with self.profiler.timing("save_calibration"):
+                storage.save_calibration(self.slope, self.intercept, self.weights, self.voltages)
             self.ui_state = ui_states.TEST_FIRE
             self.calibration_state = None
             self.test_fire_state = test_fire_ui_states.START
@@ -268,10 +354,21 @@ class UI(ctk.CTk):
 
     def start_test_fire_button(self):
         if self.ui_state == ui_states.TEST_FIRE and self.test_fire_state == test_fire_ui_states.START:
-            self.test_fire_state = test_fire_ui_states.DATA_ACQUISITION
+            from daq import DAQ
             self.test_fire_daq = DAQ()
             self.test_fire_daq.connect()
-            self.test_fire_daq.start_scan()
+            try:
+                # The scan is planned and checked before anything starts, so on an error nothing is running
+                self.test_fire_daq.start_scan()
+            except RuntimeError as e:
+                print('\n', e)
+                self.test_fire_daq.disconnect()
+                self.test_fire_daq.release()
+                self.start_error_label.config(text=str(e))
+                self.start_error_label.place(x=10, y=550)
+                return
+            self.start_error_label.place_forget()
+            self.test_fire_state = test_fire_ui_states.DATA_ACQUISITION
             self.set_UI_visibility_based_on_state()
 
     def timer_update(self):
@@ -279,29 +376,34 @@ class UI(ctk.CTk):
         self.timer_label.config(text=f"{self.timer} s", font=("Arial", 24))
         self.after(1000, self.timer_update)
 
+    @profiling.timed()
     def terminate_test_fire_button(self):
         if self.ui_state == ui_states.TEST_FIRE and self.test_fire_state == test_fire_ui_states.DATA_ACQUISITION:
             self.pressure_transducer_data, self.load_cell_data = self.test_fire_daq.stop_scan()
             self.test_fire_daq.disconnect()
             self.test_fire_daq.release()
+
+            import storage
+            from derived import standard_channels
+            metadata = {"rate": self.test_fire_daq.rate or 1000,
+                        "calibration": {"slope": self.slope, "intercept": self.intercept},
+                        "pressure_scale": storage.load_pressure_scale()}
+            self.derived = standard_channels(metadata, {storage.CHANNEL_NAMES[0]: self.pressure_transducer_data,
+                                                        storage.CHANNEL_NAMES[1]: self.load_cell_data})
             self.test_fire_state = test_fire_ui_states.PRESSURE_TRANSDUCER
             self.set_UI_visibility_based_on_state()
 
     def save_data_as_csv(self):
-        path = ""
-        for entry in self.data_save_entries:
-            path = path + str(entry.get()) + "_"
-        path = path[:-1]
-        root_path = os.path.expanduser("~/pydaq/testFireData")
-        folder_path = os.path.join(root_path, path)
-        os.makedirs(folder_path, exist_ok=True)     
-
-        np.savetxt(os.path.join(folder_path, "pressure_transducer.csv"), self.pressure_transducer_data, delimiter=",")
-        np.savetxt(os.path.join(folder_path, "raw_load_cell.csv"), self.load_cell_data, delimiter=",")
-        calibrated_data = self.slope * self.load_cell_data + self.intercept
-        np.savetxt(os.path.join(folder_path, "calibrated_load_cell.csv"), calibrated_data, delimiter=",")
+        import storage
+        folder_path = storage.test_folder(entry.get() for entry in self.data_save_entries)
+        with self.profiler.timing("save_test"):
+            storage.save_test(folder_path, self.pressure_transducer_data, self.load_cell_data, self.slope,
+                              self.intercept, rate=self.test_fire_daq.rate or 1000,
+                              calibrated=self.derived[storage.CALIBRATED_NAME],
+                              pressure_scale=storage.load_pressure_scale())
         self.destroy()
 
 if __name__ == "__main__":
-    ui = UI()
+    ui = UI(profile="--profile" in sys.argv[1:])
     ui.mainloop()
+    ui.profiler.finish()